@@ -1,17 +1,31 @@
 
 import os
-import tempfile
+import itertools
 
 GLOBAL_TIMEOUT = 30
 BUFSIZE = 1024
 INTERRUPTED_TRANSF_SIZE = 32768
 
-TEST_PREFIX = f'ftptest-tmp-{os.getpid()}-'
+TEST_PREFIX_BASE = 'ftptest-tmp-'
+TEST_PREFIX = f'{TEST_PREFIX_BASE}{os.getpid()}-'
 
-def get_tmpfilename(suffix=""):
-    name = tempfile.mktemp(prefix=TEST_PREFIX, suffix=suffix)
-    return os.path.basename(name)
+# pytest-xdist names its workers gw0, gw1, ...; load drivers running
+# several processes set their own id with set_worker_id()
+worker_id = os.environ.get('PYTEST_XDIST_WORKER', 'main')
+name_counter = itertools.count()
+
+def set_worker_id(wid):
+    global worker_id
+    worker_id = str(wid)
 
-def touch_filename(fpath):
-    with open(fpath, 'wb') as f:
-        pass
+def get_share_path(uconfig):
+    p = os.path.normpath('/'.join([uconfig.get('work_dir'), uconfig.get('share_name')]))
+    if p.startswith('//'):
+        return p.replace('//', '/')
+    else:
+        return p
+
+def get_tmpfilename(suffix=""):
+    # names are only used on the server, so don't probe the local
+    # filesystem for them; pid, worker id and counter keep them unique
+    return f'{TEST_PREFIX}{worker_id}-{next(name_counter)}{suffix}'
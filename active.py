@@ -0,0 +1,155 @@
+import errno
+import select
+import socket
+import threading
+import time
+
+# above the default linux ephemeral range (32768-60999), so outgoing
+# connections don't take the ports we want to listen on
+PORT_RANGE = (61000, 61999)
+
+class ListenerPool:
+    """Listening sockets for active mode transfers, bound to a bounded
+    local port range and reused from one transfer to the next.
+
+    A listener is leased to one transfer at a time. When it is handed out
+    again, connections left in its backlog by an earlier transfer (a late
+    connect after ABOR, say) are drained first, and accept() only takes
+    connections from `peer` when one is given, so a transfer doesn't pick
+    up somebody else's data connection. Ports that fail to bind are
+    skipped. acquire() waits for a release once every port is in use.
+    """
+
+    def __init__(self, host, family=socket.AF_INET, port_range=PORT_RANGE, backlog=4):
+        self.host = host
+        self.family = family
+        self.backlog = backlog
+        self.ports = list(range(port_range[0], port_range[1] + 1))
+        self.next_port = 0
+        self.idle = []
+        self.leased = 0
+        self.cond = threading.Condition()
+        self.stats = {'created': 0, 'reused': 0, 'bind_failures': 0, 'stale_conns': 0, 'waits': 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def bind_next(self):
+        # caller holds the lock, walks the range once from the last port
+        for _ in range(len(self.ports)):
+            port = self.ports[self.next_port]
+            self.next_port = (self.next_port + 1) % len(self.ports)
+            sock = socket.socket(self.family, socket.SOCK_STREAM)
+            # our end of a finished data connection sits in TIME_WAIT on
+            # the listener's port, which must not block a new bind
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                sock.bind((self.host, port))
+                sock.listen(self.backlog)
+            except OSError as e:
+                sock.close()
+                if e.errno not in (errno.EADDRINUSE, errno.EACCES):
+                    raise
+                self.stats['bind_failures'] += 1
+                continue
+            self.stats['created'] += 1
+            return sock
+        return None
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout == None else time.monotonic() + timeout
+        with self.cond:
+            while True:
+                if self.idle:
+                    sock = self.idle.pop()
+                    self.stats['reused'] += 1
+                    stale = True
+                    break
+                if self.leased + len(self.idle) < len(self.ports):
+                    sock = self.bind_next()
+                    if sock != None:
+                        stale = False
+                        break
+                remaining = None if deadline == None else deadline - time.monotonic()
+                if remaining != None and remaining <= 0:
+                    raise TimeoutError(f'no free listener in ports {self.ports[0]}-{self.ports[-1]}')
+                self.stats['waits'] += 1
+                self.cond.wait(remaining)
+            self.leased += 1
+        if stale:
+            try:
+                n = self.drain(sock)
+            except OSError:
+                self.release(sock, reuse=False)
+                return self.acquire(timeout)
+            with self.cond:
+                self.stats['stale_conns'] += n
+        return sock
+
+    def drain(self, sock):
+        stale = 0
+        while select.select([sock], [], [], 0)[0]:
+            sock.setblocking(False)
+            try:
+                conn, _ = sock.accept()
+            except BlockingIOError:
+                break
+            conn.close()
+            stale += 1
+        return stale
+
+    def release(self, sock, reuse=True):
+        if not reuse:
+            sock.close()
+        with self.cond:
+            self.leased -= 1
+            if reuse:
+                self.idle.append(sock)
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            for sock in self.idle:
+                sock.close()
+            self.idle = []
+
+class LeasedListener:
+    """A listener leased from a ListenerPool, shaped like the socket
+    ftplib's makeport() returns. Closing it gives it back to the pool.
+    accept() ignores connections that don't come from `peer`.
+    """
+
+    def __init__(self, pool, sock, timeout=None, peer=None):
+        self.pool = pool
+        self.sock = sock
+        self.timeout = timeout
+        self.peer = peer
+        self.released = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def getsockname(self):
+        return self.sock.getsockname()
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def accept(self):
+        self.sock.settimeout(self.timeout)
+        while True:
+            conn, addr = self.sock.accept()
+            if self.peer == None or addr[0] == self.peer:
+                return conn, addr
+            conn.close()
+
+    def close(self):
+        if not self.released:
+            self.released = True
+            self.pool.release(self.sock)
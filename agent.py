@@ -0,0 +1,251 @@
+import json
+import os
+import posixpath
+import queue
+import socket
+import threading
+import time
+import traceback
+
+from . import set_worker_id
+from .client import FtpClient, create_client
+from . import bench
+from .driver import WorkerResult, run_part, encode_phases, decode_phases
+from .scenario import Scenario, ScenarioRunner, Progress
+
+class Connection:
+    """JSON lines over a socket."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+        self.lock = threading.Lock()
+
+    def send(self, msg):
+        data = json.dumps(msg, separators=(',', ':')).encode() + b'\n'
+        with self.lock:
+            self.sock.sendall(data)
+
+    def receive(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError('connection closed by peer')
+        return json.loads(line)
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+class Coordinator:
+    """Drive one server from several load machines.
+
+    The coordinator listens on a TCP port and waits for `agents` agents,
+    started with run_agent() or ``python -m <package>.agent HOST:PORT`` on
+    each load machine. The protocol is one JSON object per line:
+
+        agent -> coordinator   {"type": "hello", "host": ..., "pid": ...}
+        coordinator -> agent   {"type": "prepare", "worker": i, "workers": n,
+                                "scenario": {...}, "name": ..., "uconfig": {...},
+                                "root": ..., "prepare_sessions": ...,
+                                "progress_interval": ...}
+        agent -> coordinator   {"type": "prepared"}
+        coordinator -> agent   {"type": "start", "at": <time.time()>} or {"type": "abort"}
+        agent -> coordinator   {"type": "progress", "elapsed": ..., "stats": {...}}, repeated
+        agent -> coordinator   {"type": "result", ...}
+
+    Agent i runs Scenario.shard(i, agents) under `roots`[i], which the
+    caller creates on the server. While it runs it sends what it recorded
+    since its last progress message every `progress_interval` seconds,
+    which the coordinator merges into `live` as it arrives, so a run can
+    be watched and an agent that dies still leaves its results up to its
+    last message. At the end the agent sends its complete result in the
+    form of a driver worker result. The
+    start time is wall clock time, so the clocks of the load machines
+    should be in sync.
+    """
+
+    def __init__(self, uconfig, scenario, root, agents, host='127.0.0.1', port=0, lead=1.0,
+                 prepare_sessions=2, progress_interval=1.0):
+        self.uconfig = uconfig
+        self.scenario = scenario
+        self.root = root
+        self.agents = agents
+        self.lead = lead
+        self.prepare_sessions = prepare_sessions
+        self.progress_interval = progress_interval
+        self.roots = [posixpath.join(root, f'a{i}') for i in range(agents)]
+        self.listener = socket.create_server((host, port))
+        self.address = self.listener.getsockname()[:2]
+        self.conns = []
+        self.hellos = []
+        self.messages = queue.Queue()
+        # {agent: {phase: OpStats}} streamed so far, and the number of
+        # progress messages per agent
+        self.live = {}
+        self.updates = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def accept(self, timeout=None):
+        """Wait for all agents to connect and say hello."""
+        self.listener.settimeout(timeout)
+        while len(self.conns) < self.agents:
+            sock, _ = self.listener.accept()
+            sock.settimeout(timeout)
+            conn = Connection(sock)
+            try:
+                hello = conn.receive()
+            except (OSError, ValueError):
+                # not an agent, or one that went away before saying hello
+                conn.close()
+                continue
+            if not isinstance(hello, dict) or hello.get('type') != 'hello':
+                conn.close()
+                continue
+            sock.settimeout(None)
+            self.hellos.append(hello)
+            self.conns.append(conn)
+            threading.Thread(target=self.read, args=(len(self.conns) - 1, conn), daemon=True).start()
+
+    def read(self, index, conn):
+        try:
+            while True:
+                self.messages.put((index, conn.receive()))
+        except (OSError, ValueError) as e:
+            self.messages.put((index, {'type': 'closed', 'error': str(e)}))
+
+    def wait(self, pending, timeout, types):
+        """Collect the first message of one of `types` from each agent in `pending`."""
+        deadline = time.monotonic() + timeout
+        received = {}
+        while pending - set(received):
+            try:
+                index, msg = self.messages.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                raise TimeoutError(f'agents {sorted(pending - set(received))} did not answer in {timeout}s')
+            if msg['type'] == 'progress':
+                self.merge_progress(index, msg)
+            elif index in pending and index not in received and msg['type'] in types:
+                received[index] = msg
+        return received
+
+    def merge_progress(self, index, msg):
+        phases = self.live.setdefault(index, {})
+        for phase, stats in decode_phases(msg['stats']).items():
+            phases.setdefault(phase, bench.OpStats()).merge(stats)
+        self.updates[index] = self.updates.get(index, 0) + 1
+
+    def run(self, timeout=None):
+        """Run the scenario on all agents, return their WorkerResults ordered by agent."""
+        if timeout == None:
+            timeout = self.scenario.duration() + 300
+        everyone = set(range(self.agents))
+        replies = {}
+        for i, conn in enumerate(self.conns):
+            self.send(i, {'type': 'prepare', 'worker': i, 'workers': self.agents,
+                          'scenario': self.scenario.data, 'name': self.scenario.name,
+                          'uconfig': self.uconfig, 'root': self.roots[i],
+                          'prepare_sessions': self.prepare_sessions,
+                          'progress_interval': self.progress_interval}, replies)
+        replies.update(self.wait(everyone - set(replies), timeout, ('prepared', 'result', 'closed')))
+        prepared = set(i for i, msg in replies.items() if msg['type'] == 'prepared')
+        if prepared == everyone:
+            start = {'type': 'start', 'at': time.time() + self.lead}
+        else:
+            start = {'type': 'abort'}
+        for i in sorted(prepared):
+            # an agent gone after preparing doesn't stop the others
+            if not self.send(i, start, replies):
+                prepared.discard(i)
+        replies.update(self.wait(prepared, timeout, ('result', 'closed')))
+        results = []
+        for i in sorted(replies):
+            msg = replies[i]
+            if msg['type'] == 'closed':
+                # keep what the agent streamed before it went away
+                msg = {'worker': i, 'pid': self.hellos[i].get('pid'), 'cpu': None, 'created': [], 'dirs': [],
+                       'stats': encode_phases(self.live.get(i, {})),
+                       'error': f"agent {i} went away: {msg['error']}"}
+            results.append(WorkerResult(msg))
+        return results
+
+    def send(self, index, msg, replies):
+        """Send `msg` to agent `index`, or record it in `replies` as closed."""
+        try:
+            self.conns[index].send(msg)
+        except OSError as e:
+            replies[index] = {'type': 'closed', 'error': str(e)}
+            return False
+        return True
+
+    def close(self):
+        for conn in self.conns:
+            conn.close()
+        self.listener.close()
+
+def report_progress(conn, progress, interval, stopped):
+    start = time.perf_counter()
+    while True:
+        last = stopped.wait(interval)
+        # the last message carries the rest, so the streamed results add
+        # up to the final one
+        conn.send({'type': 'progress', 'elapsed': time.perf_counter() - start,
+                   'stats': encode_phases(progress.take())})
+        if last:
+            return
+
+def run_agent(address, client_class=FtpClient, timeout=None):
+    """Connect to the coordinator at `address` and run what it hands out."""
+    conn = Connection(socket.create_connection(address, timeout))
+    try:
+        conn.send({'type': 'hello', 'host': socket.gethostname(), 'pid': os.getpid()})
+        conn.sock.settimeout(None)
+        msg = conn.receive()
+        index = msg['worker']
+        set_worker_id(f'a{index}')
+        part = Scenario(msg['scenario'], msg['name']).shard(index, msg['workers'])
+        runner = ScenarioRunner(msg['uconfig'], part, msg['root'], client_class)
+        interval = msg.get('progress_interval', 1.0)
+        result = {'type': 'result', 'worker': index, 'pid': os.getpid(), 'cpu': None, 'error': None}
+        try:
+            client = create_client(msg['uconfig'], client_class)
+            try:
+                runner.prepare(client, msg['prepare_sessions'])
+            finally:
+                client.close()
+            conn.send({'type': 'prepared'})
+            msg = conn.receive()
+            if msg['type'] != 'start':
+                raise RuntimeError('aborted by the coordinator')
+            delay = msg['at'] - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            runner.progress = Progress()
+            stopped = threading.Event()
+            reporter = threading.Thread(target=report_progress, daemon=True,
+                                        args=(conn, runner.progress, interval, stopped))
+            reporter.start()
+            try:
+                result.update(run_part(runner, part))
+            finally:
+                stopped.set()
+                reporter.join()
+        except Exception:
+            result['error'] = traceback.format_exc()
+        result['created'] = runner.created
+        result['dirs'] = runner.dirs
+        conn.send(result)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='FTP load agent, runs what a coordinator hands out')
+    parser.add_argument('coordinator', help='HOST:PORT of the coordinator')
+    args = parser.parse_args()
+    host, port = args.coordinator.rsplit(':', 1)
+    run_agent((host, int(port)))
@@ -0,0 +1,108 @@
+import collections
+import math
+import time
+
+from . import procstats
+from .histogram import LatencyHistogram
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of an unsorted list of samples."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(int(math.ceil(pct / 100.0 * len(ordered))) - 1, 0)
+    return ordered[rank]
+
+def summarize(samples, pcts=(50, 90, 99)):
+    summary = {'count': len(samples)}
+    for pct in pcts:
+        summary[f'p{pct}'] = percentile(samples, pct)
+    summary['max'] = max(samples) if samples else 0.0
+    return summary
+
+def report(testcase, name, **metrics):
+    """Attach benchmark metrics to the running test's report.
+
+    The metrics end up in the report's user_properties, so they are shown
+    in the terminal summary and written out by --bench_report_path.
+    """
+    properties = getattr(testcase, 'user_properties', None)
+    if properties != None:
+        properties.append((name, metrics))
+
+def linear_fit(xs, ys):
+    """Least squares fit, returns (slope, intercept, r squared)."""
+    n = len(xs)
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    syy = sum((y - mean_y) ** 2 for y in ys)
+    slope = sxy / sxx if sxx else 0.0
+    intercept = mean_y - slope * mean_x
+    r2 = (sxy * sxy) / (sxx * syy) if sxx and syy else 0.0
+    return slope, intercept, r2
+
+def measure(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def error_code(err):
+    """Reply code of an ftplib error, or the exception name."""
+    code = str(err)[:3]
+    return code if code.isdigit() else type(err).__name__
+
+class OpStats:
+    """Latency histograms and error replies per operation.
+
+    Each worker thread or process records into its own instance; merge()
+    them when the run is over. todict() and fromdict() carry an instance
+    across processes or into a JSON report.
+    """
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(LatencyHistogram)
+        self.errors = collections.Counter()
+
+    def record(self, op, seconds, err=None):
+        if err == None:
+            self.latencies[op].record(seconds)
+            if procstats.recorder != None:
+                procstats.recorder.note(seconds)
+        else:
+            self.errors[(op, error_code(err))] += 1
+
+    def merge(self, other):
+        for op, hist in other.latencies.items():
+            self.latencies[op].merge(hist)
+        self.errors.update(other.errors)
+
+    def summary(self, elapsed):
+        ops = set(self.latencies) | set(op for op, _ in self.errors)
+        result = {}
+        for op in sorted(ops):
+            hist = self.latencies.get(op) or LatencyHistogram()
+            errors = {code: n for (eop, code), n in self.errors.items() if eop == op}
+            result[op] = dict(hist.summary(),
+                              ops_per_sec=len(hist) / elapsed if elapsed else 0.0,
+                              errors=errors)
+        return result
+
+    def todict(self):
+        return {
+            'latencies': {op: hist.tostring() for op, hist in self.latencies.items()},
+            'errors': [[op, code, n] for (op, code), n in self.errors.items()],
+        }
+
+    @classmethod
+    def fromdict(cls, d):
+        stats = cls()
+        for op, text in d['latencies'].items():
+            stats.latencies[op] = LatencyHistogram.fromstring(text)
+        for op, code, n in d['errors']:
+            stats.errors[(op, code)] += n
+        return stats
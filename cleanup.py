@@ -0,0 +1,98 @@
+import os
+import posixpath
+import time
+
+from . import TEST_PREFIX, get_share_path
+from .client import ClientPool
+
+GC_SESSIONS = 4
+
+def is_test_artifact(path, prefix=TEST_PREFIX):
+    return os.path.basename(path).startswith(prefix)
+
+def parse_list_line(line):
+    """Return (type char, name) of a unix style LIST line."""
+    parts = line.split(None, 8)
+    if len(parts) < 9:
+        return None, None
+    kind, name = parts[0][:1], parts[8]
+    if kind == 'l' and ' -> ' in name:
+        name = name.split(' -> ', 1)[0]
+    return kind, name
+
+def list_dir(client, path):
+    lines = []
+    client.retrlines('list ' + path, lines.append)
+    entries = []
+    for line in lines:
+        kind, name = parse_list_line(line)
+        if name == None or name in ('.', '..'):
+            continue
+        entries.append((posixpath.join(path, name), kind == 'd'))
+    return entries
+
+class GcReport:
+    def __init__(self):
+        self.removed = []
+        self.failed = []
+        self.seconds = 0.0
+
+class ArtifactCollector:
+    """Remove leaked test files and directories from the share.
+
+    Entries whose name starts with `prefix` are removed with everything
+    below them, deepest first, spread over a pool of sessions. Plain
+    directories are searched for such entries down to `scan_depth`
+    levels below the share.
+    """
+
+    def __init__(self, uconfig, prefix=TEST_PREFIX, sessions=GC_SESSIONS, scan_depth=0):
+        self.uconfig = uconfig
+        self.prefix = prefix
+        self.sessions = sessions
+        self.scan_depth = scan_depth
+
+    def discover(self, pool, report):
+        # breadth first, every level of directories listed in parallel;
+        # a directory that can't be listed is a failure of the sweep
+        files = []
+        dirs = []
+        level = {get_share_path(self.uconfig): False}
+        depth = 0
+        while level:
+            next_level = {}
+            for path, entries, err in pool.map(list_dir, list(level)):
+                if err != None:
+                    report.failed.append((path, f'list: {err}'))
+                    continue
+                for entry, is_dir in entries:
+                    if level[path] or is_test_artifact(entry, self.prefix):
+                        if is_dir:
+                            dirs.append((entry, depth))
+                            next_level[entry] = True
+                        else:
+                            files.append(entry)
+                    elif is_dir and depth < self.scan_depth:
+                        next_level[entry] = False
+            level = next_level
+            depth += 1
+        return files, dirs
+
+    def remove(self, pool, paths, cmd, report):
+        for path, _, err in pool.map(lambda client, p: getattr(client, cmd)(p), paths):
+            if err == None:
+                report.removed.append(path)
+            else:
+                report.failed.append((path, str(err)))
+
+    def collect(self):
+        report = GcReport()
+        start = time.perf_counter()
+        with ClientPool(self.uconfig, self.sessions) as pool:
+            files, dirs = self.discover(pool, report)
+            self.remove(pool, files, 'delete', report)
+            # depth first: a directory is only empty once its children are gone
+            for depth in sorted(set(d for _, d in dirs), reverse=True):
+                self.remove(pool, [p for p, d in dirs if d == depth], 'rmd', report)
+        report.seconds = time.perf_counter() - start
+        return report
@@ -0,0 +1,307 @@
+import contextlib
+import ftplib
+import queue
+import re
+import socket
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import GLOBAL_TIMEOUT
+from . import xferstats
+from . import sockstats
+from . import active
+
+PIPELINE_WINDOW = 64
+ZERO_BLOCK = bytes(65536)
+
+# set once a session of this process connected to the server
+connected = False
+
+class FixedSizeReader:
+    """File-like object reading `size` zero bytes straight from memory."""
+
+    def __init__(self, size=0):
+        self.remaining = size
+
+    def read(self, blocksize=-1):
+        if blocksize < 0 or blocksize > len(ZERO_BLOCK):
+            blocksize = len(ZERO_BLOCK)
+        n = min(blocksize, self.remaining)
+        self.remaining -= n
+        return memoryview(ZERO_BLOCK)[:n]
+
+class FtpClient(ftplib.FTP):
+    """ftplib.FTP plus the extra entry points the harness needs."""
+
+    # transfer being set up, and transfer waiting for its final reply
+    starting_trace = None
+    pending_trace = None
+    # active.ListenerPool used by makeport() instead of ad-hoc listeners
+    listeners = None
+    # use EPSV/EPRT over IPv4 too, so both families run the same commands
+    extended = False
+    # reply to the last sendcmd(), the 1xx reply of a transfer included
+    last_reply = None
+
+    def connect(self, *args, **kwargs):
+        global connected
+        welcome = super().connect(*args, **kwargs)
+        connected = True
+        if sockstats.recorder != None:
+            peer = '%s:%s' % self.sock.getpeername()[:2]
+            self.sock = sockstats.CountedSocket(self.sock, sockstats.recorder.new_counter('control', peer))
+            self.file.close()
+            self.file = self.sock.makefile('r', encoding=self.encoding)
+        return welcome
+
+    def ntransfercmd(self, cmd, rest=None):
+        self.pending_trace = None
+        trace = None
+        if xferstats.recorder != None:
+            trace = xferstats.recorder.new_trace(cmd)
+            self.starting_trace = trace
+        try:
+            conn, size = super().ntransfercmd(cmd, rest)
+        finally:
+            self.starting_trace = None
+        if sockstats.recorder != None:
+            conn = sockstats.CountedSocket(conn, sockstats.recorder.new_counter('data', cmd))
+        if trace == None:
+            return conn, size
+        trace.mark('reply_150')
+        self.pending_trace = trace
+        return xferstats.TracedConnection(conn, trace), size
+
+    def makepasv(self):
+        if self.extended and self.af == socket.AF_INET:
+            result = ftplib.parse229(self.sendcmd('EPSV'), self.sock.getpeername())
+        else:
+            result = super().makepasv()
+        if self.starting_trace != None:
+            self.starting_trace.mark('pasv')
+        return result
+
+    def makeport(self):
+        if self.listeners == None and not self.extended:
+            result = super().makeport()
+        else:
+            timeout = self.timeout if isinstance(self.timeout, (int, float)) else None
+            if self.listeners != None:
+                sock = self.listeners.acquire(timeout)
+                result = active.LeasedListener(self.listeners, sock, timeout, self.sock.getpeername()[0])
+            else:
+                sock = result = socket.create_server(('', 0), family=self.af, backlog=1)
+                sock.settimeout(timeout)
+            host = self.sock.getsockname()[0]
+            port = sock.getsockname()[1]
+            try:
+                if self.af == socket.AF_INET and not self.extended:
+                    self.sendport(host, port)
+                else:
+                    self.sendeprt(host, port)
+            except BaseException:
+                result.close()
+                raise
+        if self.starting_trace != None:
+            self.starting_trace.mark('pasv')
+        return result
+
+    def sendcmd(self, cmd):
+        self.last_reply = super().sendcmd(cmd)
+        return self.last_reply
+
+    def putline(self, line):
+        # a new command means the pending transfer's reply is not awaited
+        self.pending_trace = None
+        super().putline(line)
+
+    def voidresp(self):
+        resp = super().voidresp()
+        if self.pending_trace != None:
+            self.pending_trace.mark('reply_226')
+            self.pending_trace = None
+        return resp
+
+    def sendcmds(self, cmds, window=PIPELINE_WINDOW):
+        """Send control commands pipelined and return their replies in order.
+
+        Up to `window` commands are written ahead of the replies read back,
+        so the server's reply queue can't fill up while we are still
+        writing. Replies are returned raw (multiline replies included) and
+        error codes are not raised, so negative paths can be checked per
+        command. Commands that open a data connection can't be batched.
+        """
+        resps = []
+        sent = 0
+        while len(resps) < len(cmds):
+            lines = []
+            while sent < len(cmds) and sent - len(resps) < window:
+                lines.append(self.sanitize_line(cmds[sent]))
+                sent += 1
+            if lines:
+                self.pending_trace = None
+                if self.debugging > 1:
+                    for line in lines:
+                        print('*put*', self.sanitize(line))
+                self.sock.sendall(''.join(lines).encode(self.encoding))
+            resps.append(self.getmultiline())
+        return resps
+
+    def voidcmds(self, cmds, window=PIPELINE_WINDOW):
+        """Like sendcmds() but raise on the first reply that isn't 2xx."""
+        resps = self.sendcmds(cmds, window)
+        for resp in resps:
+            check_reply(resp)
+        return resps
+
+    def cancel_transfer(self, conn, method='abor', timeout=None):
+        """Cancel the transfer running on data connection `conn`.
+
+        'abor' sends ABOR as urgent data like ftplib.FTP.abort() and
+        closes the data connection like a client cancelling a transfer,
+        'close' only resets the data connection. The reset (SO_LINGER 0)
+        matters for uploads: a plain close is an EOF, which the server
+        takes for a complete upload.
+        Servers answer with one or two replies (426 and/or 225/226), so a
+        NOOP is sent after the cancel and replies are read until its 200.
+        A server may answer the NOOP while a reset upload is still being
+        finished, so after a 'close' the transfer's reply is also waited
+        for. TimeoutError is raised when that takes over `timeout` seconds
+        (the session timeout by default).
+        Returns the cancel replies and the seconds until the first reply
+        (ack), the last one (final) and until the NOOP is answered (usable).
+        """
+        if timeout == None:
+            timeout = self.timeout if isinstance(self.timeout, (int, float)) else GLOBAL_TIMEOUT
+        start = time.perf_counter()
+        deadline = start + timeout
+        self.pending_trace = None
+        if method == 'abor':
+            self.sock.sendall(b'ABOR' + ftplib.B_CRLF, socket.MSG_OOB)
+            conn.close()
+        else:
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            conn.close()
+        self.sock.sendall(b'NOOP' + ftplib.B_CRLF)
+        replies = []
+        timings = {}
+        answered = False
+        saved = self.sock.gettimeout()
+        try:
+            while True:
+                left = deadline - time.perf_counter()
+                if left <= 0:
+                    raise TimeoutError(f'no reply to NOOP {timeout}s after cancelling a transfer')
+                self.sock.settimeout(left)
+                resp = self.getmultiline()
+                now = time.perf_counter() - start
+                if resp[:3] == '200':
+                    answered = True
+                else:
+                    timings.setdefault('ack', now)
+                    timings['final'] = now
+                    replies.append(resp)
+                if answered and (replies or method == 'abor'):
+                    break
+        finally:
+            self.sock.settimeout(saved)
+        timings['usable'] = now
+        return replies, timings
+
+    def stor_unique(self, fp, blocksize=8192):
+        """STOU the contents of `fp` into the current directory and return
+        the name the server picked, None when the 1xx reply doesn't say.
+        """
+        self.storbinary('stou', fp, blocksize)
+        match = re.search(r'FILE:\s*(.+)', self.last_reply)
+        return match.group(1).strip() if match else None
+
+    def upload_fixed_size(self, path, size=0):
+        """STOR `size` zero bytes to `path` without a local file."""
+        return self.storbinary('stor ' + path, FixedSizeReader(size))
+
+    def sanitize_line(self, line):
+        if '\r' in line or '\n' in line:
+            raise ValueError('an illegal newline character should not be contained')
+        return line + ftplib.CRLF
+
+def check_reply(resp):
+    """Raise the ftplib error for a reply that isn't 2xx."""
+    c = resp[:1]
+    if c == '4':
+        raise ftplib.error_temp(resp)
+    if c == '5':
+        raise ftplib.error_perm(resp)
+    if c != '2':
+        raise ftplib.error_reply(resp)
+
+def create_client(uconfig, client_class=FtpClient, login=True):
+    server_host = uconfig.get('server_host')
+    server_port = uconfig.get('server_port', 21)
+    server_user = uconfig.get('server_user')
+    server_password = uconfig.get('server_password')
+    timeout = uconfig.get('global_timeout', GLOBAL_TIMEOUT)
+    assert(server_host != None and server_user != None and server_password != None)
+    client = client_class(timeout=timeout)
+    client.connect(server_host, server_port)
+    if login:
+        client.login(server_user, server_password)
+    return client
+
+class ClientPool:
+    """Fixed set of logged-in sessions shared by worker threads."""
+
+    def __init__(self, uconfig, size, client_class=FtpClient):
+        self.uconfig = uconfig
+        self.size = size
+        self.client_class = client_class
+        self.clients = queue.Queue()
+        try:
+            for _ in range(size):
+                self.clients.put(create_client(uconfig, client_class))
+        except BaseException:
+            while not self.clients.empty():
+                self.clients.get().close()
+            raise
+        self.executor = ThreadPoolExecutor(size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextlib.contextmanager
+    def client(self):
+        client = self.clients.get()
+        try:
+            yield client
+        except ftplib.Error:
+            raise
+        except Exception:
+            # the session is probably unusable, replace it
+            client.close()
+            client = create_client(self.uconfig, self.client_class)
+            raise
+        finally:
+            self.clients.put(client)
+
+    def map(self, func, items):
+        """Run func(client, item) for all items, one session per call.
+
+        Returns (item, result, error) tuples in the order of items; ftplib
+        and socket errors are returned instead of raised.
+        """
+        def run(item):
+            try:
+                with self.client() as client:
+                    return item, func(client, item), None
+            except ftplib.all_errors as e:
+                return item, None, e
+        return list(self.executor.map(run, items))
+
+    def close(self):
+        self.executor.shutdown()
+        while not self.clients.empty():
+            self.clients.get().close()
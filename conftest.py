@@ -1,22 +1,240 @@
 import pytest
 import os
+import re
 import json
+import ftplib
 
-from . import GLOBAL_TIMEOUT
+from . import GLOBAL_TIMEOUT, TEST_PREFIX, TEST_PREFIX_BASE, get_share_path
+from .cleanup import ArtifactCollector, GcReport
+from . import xferstats
+from . import sockstats
+from . import procstats
+from . import client
+from .profiling import MemoryProfile, CpuProfile, PROFILERS
 
 def pytest_addoption(parser):
     parser.addoption('--user_config_path', action='store', default='', help='user config json path')
+    parser.addoption('--bench_report_path', action='store', default='', help='write benchmark results to this json path')
+    parser.addoption('--ftp_gc', action='store', default='on', choices=('off', 'on', 'all'),
+                     help='remove leaked test files at session end: this session only (on) '
+                          'or left by any session (all)')
+    parser.addoption('--trace_transfers', action='store_true', default=False,
+                     help='timestamp every data chunk and transfer phase, report stall '
+                          'metrics and phase latencies')
+    parser.addoption('--trace_interval', action='store', type=float, default=0.1,
+                     help='seconds per throughput sample of --trace_transfers')
+    parser.addoption('--stall_threshold', action='store', type=float, default=50,
+                     help='report time spent below this percent of the median transfer rate')
+    parser.addoption('--socket_stats', action='store_true', default=False,
+                     help='count send/recv calls, bytes, partial writes and blocked time '
+                          'of control and data sockets, sample TCP_INFO at close')
+    parser.addoption('--server_stats', action='store_true', default=False,
+                     help='sample cpu, rss, fds, threads and context switches of a server '
+                          'on this host (server_pid or the listener on server_port) from /proc')
+    parser.addoption('--server_interval', action='store', type=float, default=0.1,
+                     help='seconds between samples of --server_stats')
+    parser.addoption('--memory_profile', action='store_true', default=False,
+                     help='record peak python memory and top allocation sites per test')
+    parser.addoption('--memory_budget', action='store', type=float, default=0,
+                     help='fail tests whose peak python memory exceeds this many MB '
+                          '(implies --memory_profile)')
+    parser.addoption('--memory_top', action='store', type=int, default=5,
+                     help='number of allocation sites reported by --memory_profile')
+    parser.addoption('--ftp_profile', action='store', default='off', choices=PROFILERS,
+                     help='profile each test call with cProfile or a stack sampler, write '
+                          'per-test profiles and collapsed stacks, report wall vs cpu time')
+    parser.addoption('--profile_dir', action='store', default='ftp-profiles',
+                     help='directory for the files written by --ftp_profile')
+    parser.addoption('--profile_interval', action='store', type=float, default=0.005,
+                     help='seconds between stack samples of --ftp_profile=sample')
+    parser.addoption('--defer_cleanup', action='store_true', default=False,
+                     help='skip per-test cleanup of temp files and leave it to --ftp_gc')
 
-@pytest.fixture(scope="session", autouse=True)
-def user_config(request):
-    config_path = request.config.getoption('--user_config_path')
+def load_user_config(config):
+    config_path = config.getoption('--user_config_path')
     assert(config_path != '' and os.path.exists(config_path))
     if not os.path.isabs(config_path):
         config_path = os.path.abspath(config_path)
     with open(config_path, 'r') as f:
-        uconfig = json.load(f)
-    return uconfig
+        return json.load(f)
+
+@pytest.fixture(scope="session")
+def user_config(request):
+    return load_user_config(request.config)
 
 @pytest.fixture(scope="class", autouse=True)
-def set_user_config(request, user_config):
-    request.cls.uconfig = user_config
+def set_user_config(request):
+    # unit tests run without a server config
+    if request.node.get_closest_marker('unit') != None:
+        return
+    request.cls.uconfig = request.getfixturevalue('user_config')
+    request.cls.defer_cleanup = request.config.getoption('--defer_cleanup')
+
+@pytest.fixture(autouse=True)
+def set_user_properties(request):
+    # let unittest style testcases attach results to their own report
+    if request.instance != None:
+        request.instance.user_properties = request.node.user_properties
+
+@pytest.fixture(autouse=True)
+def trace_transfers(request):
+    if not request.config.getoption('--trace_transfers'):
+        yield
+        return
+    recorder = xferstats.TransferRecorder(request.config.getoption('--trace_interval'),
+                                          request.config.getoption('--stall_threshold'))
+    with xferstats.recording(recorder):
+        yield
+    if recorder.traces:
+        request.node.user_properties.append(('transfers', recorder.results()))
+        request.node.user_properties.append(('transfer_phases', recorder.phase_summary()))
+
+def profile_path(config, item):
+    path = config.invocation_params.dir / config.getoption('--profile_dir')
+    path.mkdir(parents=True, exist_ok=True)
+    return str(path / re.sub(r'[^\w.-]+', '_', item.nodeid))
+
+@pytest.fixture(autouse=True)
+def socket_stats(request):
+    if not request.config.getoption('--socket_stats'):
+        yield
+        return
+    recorder = sockstats.SocketRecorder()
+    with sockstats.recording(recorder):
+        yield
+    if recorder.counters:
+        request.node.user_properties.append(('sockets', recorder.results()))
+
+@pytest.fixture(autouse=True)
+def server_stats(request):
+    if not request.config.getoption('--server_stats') or request.node.get_closest_marker('unit') != None:
+        yield
+        return
+    pid = procstats.server_pid(request.getfixturevalue('user_config'))
+    if pid == None:
+        request.node.user_properties.append(('server', {'error': 'no local server process found, set server_pid'}))
+        yield
+        return
+    sampler = procstats.ServerSampler(pid, request.config.getoption('--server_interval'))
+    try:
+        sampler.start()
+    except OSError as e:
+        # e.g. a server running as another user
+        request.node.user_properties.append(('server', {'pid': pid, 'error': f'cannot sample: {e}'}))
+        yield
+        return
+    with procstats.recording(sampler):
+        yield
+    sampler.stop()
+    request.node.user_properties.append(('server', sampler.results()))
+
+@pytest.hookimpl(wrapper=True)
+def pytest_runtest_call(item):
+    config = item.config
+    budget = config.getoption('--memory_budget')
+    marker = item.get_closest_marker('memory_budget')
+    if marker != None:
+        budget = marker.args[0]
+    memory = None
+    if config.getoption('--memory_profile') or budget:
+        memory = MemoryProfile(config.getoption('--memory_top'))
+    cpu = None
+    if config.getoption('--ftp_profile') != 'off':
+        cpu = CpuProfile(config.getoption('--ftp_profile'), config.getoption('--profile_interval'))
+    if memory == None and cpu == None:
+        return (yield)
+    if memory != None:
+        memory.start()
+    if cpu != None:
+        cpu.start()
+    try:
+        result = yield
+    finally:
+        if cpu != None:
+            item.user_properties.append(('profile', cpu.stop(profile_path(config, item))))
+        if memory != None:
+            usage = memory.stop()
+            item.user_properties.append(('memory', usage))
+    if budget and usage['peak_mb'] > budget:
+        pytest.fail(f"peak python memory {usage['peak_mb']:.1f} MB exceeds the "
+                    f"{budget:g} MB budget, top sites: {usage['top']}")
+    return result
+
+def brief(value):
+    # the terminal summary leaves out time series and per connection lists
+    if isinstance(value, dict):
+        return {k: brief(v) for k, v in value.items() if k not in ('series', 'per_connection')}
+    if isinstance(value, list):
+        return [brief(v) for v in value]
+    return value
+
+bench_results = []
+gc_reports = []
+
+call_outcomes = {}
+
+def pytest_runtest_logreport(report):
+    # fixtures may still add properties during teardown
+    if report.when == 'call':
+        call_outcomes[report.nodeid] = report.outcome
+    elif report.when == 'teardown' and report.user_properties:
+        bench_results.append({
+            'nodeid': report.nodeid,
+            'outcome': call_outcomes.pop(report.nodeid, 'error'),
+            'results': dict(report.user_properties),
+        })
+
+def pytest_terminal_summary(terminalreporter):
+    for report in gc_reports:
+        terminalreporter.section('leaked test artifacts')
+        first_error = f', first error: {report.failed[0][1]}' if report.failed else ''
+        terminalreporter.write_line(f'removed {len(report.removed)} entries, '
+                                    f'{len(report.failed)} failed, in {report.seconds:.3f}s{first_error}')
+        if terminalreporter.verbosity > 0:
+            for path in report.removed:
+                terminalreporter.write_line(f'    removed {path}')
+        for path, err in report.failed:
+            terminalreporter.write_line(f'    failed {path}: {err}')
+    if not bench_results:
+        return
+    terminalreporter.section('benchmark results')
+    for result in bench_results:
+        terminalreporter.write_line(result['nodeid'])
+        for name, metrics in result['results'].items():
+            terminalreporter.write_line(f'    {name}: {brief(metrics)}')
+
+def collect_leaked_artifacts(config):
+    gc_mode = config.getoption('--ftp_gc')
+    if gc_mode == 'off' and not config.getoption('--defer_cleanup'):
+        return
+    if config.option.collectonly or config.getoption('--user_config_path') == '':
+        return
+    if gc_mode == 'all':
+        # an xdist worker must not remove what its siblings still use
+        if hasattr(config, 'workerinput'):
+            return
+        prefix = TEST_PREFIX_BASE
+    elif not client.connected:
+        # no test of this session talked to the server, nothing leaked
+        return
+    else:
+        prefix = TEST_PREFIX
+    uconfig = load_user_config(config)
+    collector = ArtifactCollector(uconfig, prefix,
+                                  sessions=uconfig.get('gc_sessions', 4),
+                                  scan_depth=uconfig.get('gc_scan_depth', 0))
+    try:
+        gc_reports.append(collector.collect())
+    except ftplib.all_errors + (AssertionError,) as e:
+        # AssertionError: create_client() found no server in the config
+        report = GcReport()
+        err = str(e) or 'server_host, server_user and server_password must be set'
+        report.failed.append((get_share_path(uconfig), err))
+        gc_reports.append(report)
+
+def pytest_sessionfinish(session):
+    collect_leaked_artifacts(session.config)
+    report_path = session.config.getoption('--bench_report_path')
+    if report_path != '' and bench_results:
+        with open(report_path, 'w') as f:
+            json.dump(bench_results, f, indent=2, default=str)
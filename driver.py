@@ -0,0 +1,176 @@
+import multiprocessing
+import os
+import posixpath
+import queue
+import resource
+import time
+import traceback
+
+from . import bench, set_worker_id
+from .client import FtpClient, create_client
+from .histogram import LatencyHistogram
+from .scenario import ScenarioRunner
+
+# a worker that keeps its CPU this busy is likely measuring itself
+# rather than the server
+CPU_BOUND = 0.8
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def encode_phases(phases):
+    return {phase: stats.todict() for phase, stats in phases.items()}
+
+def decode_phases(phases):
+    return {phase: bench.OpStats.fromdict(d) for phase, d in phases.items()}
+
+def run_part(runner, part):
+    """Run a prepared ScenarioRunner, return its results encoded for WorkerResult."""
+    cpu_start = cpu_seconds()
+    phases, durations = runner.run()
+    return {
+        'stats': encode_phases(phases),
+        'service': encode_phases(runner.service),
+        'lag': {phase: hist.tostring() for phase, hist in runner.lag.items()},
+        'durations': durations,
+        'elapsed': runner.elapsed,
+        'cpu_seconds': cpu_seconds() - cpu_start,
+        'planned': len(runner.plan) if part.mode == 'open' else 0,
+    }
+
+def run_worker(index, uconfig, part, root, cpu, prepare_sessions, client_class, barrier, results):
+    """Body of a worker process: prepare, wait for the others, run `part`."""
+    set_worker_id(f'p{index}')
+    if cpu != None:
+        os.sched_setaffinity(0, {cpu})
+    runner = ScenarioRunner(uconfig, part, root, client_class)
+    result = {'worker': index, 'pid': os.getpid(), 'cpu': cpu, 'error': None}
+    try:
+        try:
+            client = create_client(uconfig, client_class)
+            try:
+                runner.prepare(client, prepare_sessions)
+            finally:
+                client.close()
+        except BaseException:
+            barrier.abort()
+            raise
+        barrier.wait()
+        result.update(run_part(runner, part))
+    except BaseException:
+        result['error'] = traceback.format_exc()
+    finally:
+        result['created'] = runner.created
+        result['dirs'] = runner.dirs
+        results.put(result)
+
+class WorkerResult:
+    def __init__(self, d):
+        self.worker = d['worker']
+        self.pid = d['pid']
+        self.cpu = d['cpu']
+        self.error = d['error']
+        self.created = d['created']
+        self.dirs = d['dirs']
+        self.stats = decode_phases(d.get('stats', {}))
+        self.service = decode_phases(d.get('service', {}))
+        self.lag = {phase: LatencyHistogram.fromstring(text) for phase, text in d.get('lag', {}).items()}
+        self.durations = d.get('durations', {})
+        self.elapsed = d.get('elapsed', 0.0)
+        self.cpu_seconds = d.get('cpu_seconds', 0.0)
+        self.planned = d.get('planned', 0)
+
+    def ops(self):
+        return sum(len(hist) for stats in self.stats.values() for hist in stats.latencies.values())
+
+    def errors(self):
+        return sum(sum(stats.errors.values()) for stats in self.stats.values())
+
+    def cpu_pct(self):
+        return 100.0 * self.cpu_seconds / self.elapsed if self.elapsed else 0.0
+
+    def cpu_bound(self, threshold=CPU_BOUND):
+        return self.cpu_seconds > threshold * self.elapsed
+
+class LoadDriver:
+    """Run a Scenario from `workers` processes to get past the GIL.
+
+    The scenario is sharded with Scenario.shard(), each worker works
+    under its own directory `root`/w<i>, and on Linux worker i can be
+    pinned to the i-th CPU the driver may run on. Workers prepare their
+    files, wait for each other and start together, record into their own
+    OpStats histograms and send them back encoded when they are done.
+    """
+
+    def __init__(self, uconfig, scenario, root, workers=2, affinity=False, prepare_sessions=2,
+                 client_class=FtpClient):
+        self.uconfig = uconfig
+        self.scenario = scenario
+        self.root = root
+        self.workers = workers
+        self.affinity = affinity and hasattr(os, 'sched_setaffinity')
+        self.prepare_sessions = prepare_sessions
+        self.client_class = client_class
+        self.roots = [posixpath.join(root, f'w{i}') for i in range(workers)]
+
+    def cpus(self):
+        if not self.affinity:
+            return [None] * self.workers
+        allowed = sorted(os.sched_getaffinity(0))
+        return [allowed[i % len(allowed)] for i in range(self.workers)]
+
+    def run(self, timeout=None):
+        """Run the workers, return their WorkerResults ordered by worker.
+
+        Workers that fail still return the paths they created, so the
+        caller can clean up before raising on `error`.
+        """
+        if timeout == None:
+            timeout = self.scenario.duration() + 300
+        # spawn, so workers don't inherit the threads and recorders of
+        # the process that runs the tests
+        ctx = multiprocessing.get_context('spawn')
+        barrier = ctx.Barrier(self.workers, timeout=timeout)
+        results = ctx.Queue()
+        procs = []
+        for i, cpu in enumerate(self.cpus()):
+            proc = ctx.Process(target=run_worker, name=f'ftp-load-{i}', daemon=True,
+                               args=(i, self.uconfig, self.scenario.shard(i, self.workers), self.roots[i],
+                                     cpu, self.prepare_sessions, self.client_class, barrier, results))
+            proc.start()
+            procs.append(proc)
+        collected = {}
+        deadline = time.monotonic() + timeout
+        try:
+            while len(collected) < self.workers:
+                try:
+                    d = results.get(timeout=1)
+                except queue.Empty:
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f'load driver workers did not finish in {timeout}s')
+                    for i, proc in enumerate(procs):
+                        if proc.exitcode not in (None, 0) and i not in collected:
+                            raise RuntimeError(f'{proc.name} exited with {proc.exitcode}')
+                    continue
+                collected[d['worker']] = WorkerResult(d)
+        finally:
+            for proc in procs:
+                proc.join(5)
+                if proc.is_alive():
+                    proc.terminate()
+        return [collected[i] for i in sorted(collected)]
+
+def aggregate(results):
+    """Merge the phases of all workers: ({phase: OpStats}, {phase: OpStats}, {phase: LatencyHistogram})."""
+    stats = {}
+    service = {}
+    lag = {}
+    for result in results:
+        for phase, phase_stats in result.stats.items():
+            stats.setdefault(phase, bench.OpStats()).merge(phase_stats)
+        for phase, phase_stats in result.service.items():
+            service.setdefault(phase, bench.OpStats()).merge(phase_stats)
+        for phase, hist in result.lag.items():
+            lag.setdefault(phase, LatencyHistogram()).merge(hist)
+    return stats, service, lag
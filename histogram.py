@@ -0,0 +1,166 @@
+import base64
+import math
+import struct
+import zlib
+from array import array
+
+HEADER = struct.Struct('<4sBddBqdd')
+MAGIC = b'FTLH'
+VERSION = 1
+
+class LatencyHistogram:
+    """Log-linear histogram of durations in seconds, HdrHistogram style.
+
+    Values are counted in integer multiples of `lowest` (1ns by default).
+    Below 2**sub_bits units buckets are exact; above, every power of two
+    is split into 2**(sub_bits-1) linear buckets, which keeps the relative
+    error under 10**-digits from `lowest` up to `highest`. record() is
+    O(1), percentiles walk the bucket array once, merge() adds counts so
+    nothing is lost, and encode() packs the counts into a few hundred
+    bytes for storing with results or sending between processes.
+    """
+
+    def __init__(self, lowest=1e-9, highest=3600.0, digits=2):
+        self.lowest = lowest
+        self.highest = highest
+        self.digits = digits
+        self.sub_bits = int(math.ceil(math.log2(10 ** digits))) + 1
+        self.sub_count = 1 << self.sub_bits
+        self.half_count = self.sub_count >> 1
+        self.max_units = max(int(highest / lowest), 1)
+        self.counts = array('q', bytes(8 * (self.index(self.max_units) + 1)))
+        self.total = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def __len__(self):
+        return self.total
+
+    def index(self, units):
+        if units < self.sub_count:
+            return units
+        shift = units.bit_length() - self.sub_bits
+        return self.sub_count + (shift - 1) * self.half_count + (units >> shift) - self.half_count
+
+    def bucket_range(self, index):
+        """[low, high) in units of the values counted in bucket `index`."""
+        if index < self.sub_count:
+            return index, index + 1
+        shift = (index - self.sub_count) // self.half_count + 1
+        mantissa = (index - self.sub_count) % self.half_count + self.half_count
+        return mantissa << shift, (mantissa + 1) << shift
+
+    def record(self, seconds, count=1):
+        units = min(max(int(seconds / self.lowest), 0), self.max_units)
+        self.counts[self.index(units)] += count
+        self.total += count
+        self.sum += seconds * count
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        if (other.lowest, other.highest, other.digits) != (self.lowest, self.highest, self.digits):
+            raise ValueError('cannot merge histograms with different ranges or precision')
+        counts = self.counts
+        for i, n in enumerate(other.counts):
+            if n:
+                counts[i] += n
+        self.total += other.total
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, pct):
+        """Nearest-rank percentile, as the top of its bucket capped by the max."""
+        if not self.total:
+            return 0.0
+        return self.value_at_rank(max(int(math.ceil(pct / 100.0 * self.total)), 1))
+
+    def value_at_rank(self, rank):
+        """The `rank`-th smallest value (from 1), as the top of its bucket."""
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.bucket_range(i)[1] * self.lowest, self.max)
+        return self.max
+
+    def mean(self):
+        return self.sum / self.total if self.total else 0.0
+
+    def summary(self, pcts=(50, 90, 99)):
+        """Same keys as bench.summarize()."""
+        summary = {'count': self.total}
+        for pct in pcts:
+            summary[f'p{pct}'] = self.percentile(pct)
+        summary['max'] = self.max
+        return summary
+
+    def encode(self):
+        header = HEADER.pack(MAGIC, VERSION, self.lowest, self.highest, self.digits,
+                             self.total, self.sum, self.max)
+        return header + zlib.compress(self.counts.tobytes())
+
+    @classmethod
+    def decode(cls, data):
+        magic, version, lowest, highest, digits, total, total_sum, maximum = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not an encoded LatencyHistogram')
+        hist = cls(lowest, highest, digits)
+        counts = array('q')
+        counts.frombytes(zlib.decompress(data[HEADER.size:]))
+        if len(counts) != len(hist.counts):
+            raise ValueError('encoded histogram does not match its header')
+        hist.counts = counts
+        hist.total = total
+        hist.sum = total_sum
+        hist.max = maximum
+        for i, n in enumerate(counts):
+            if n:
+                hist.min = hist.bucket_range(i)[0] * lowest
+                break
+        return hist
+
+    def tostring(self):
+        """encode() as base64 text, for JSON reports."""
+        return base64.b64encode(self.encode()).decode('ascii')
+
+    @classmethod
+    def fromstring(cls, text):
+        return cls.decode(base64.b64decode(text))
+
+class SignedHistogram:
+    """Differences that may be negative, as two LatencyHistograms of
+    magnitudes, one per sign.
+    """
+
+    def __init__(self):
+        self.negative = LatencyHistogram()
+        self.positive = LatencyHistogram()
+
+    def __len__(self):
+        return len(self.negative) + len(self.positive)
+
+    def record(self, value):
+        if value < 0:
+            self.negative.record(-value)
+        else:
+            self.positive.record(value)
+
+    def merge(self, other):
+        self.negative.merge(other.negative)
+        self.positive.merge(other.positive)
+
+    def percentile(self, pct):
+        total = len(self)
+        if not total:
+            return 0.0
+        rank = max(int(math.ceil(pct / 100.0 * total)), 1)
+        below = len(self.negative)
+        if rank <= below:
+            # the largest magnitudes are the smallest values
+            return -self.negative.value_at_rank(below - rank + 1)
+        return self.positive.value_at_rank(rank - below)
@@ -0,0 +1,249 @@
+import collections
+import ftplib
+import json
+import math
+import posixpath
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import bench
+from .histogram import LatencyHistogram
+from .client import FtpClient, ClientPool, create_client
+from .payload import Payload
+
+MODEL_VERSION = 1
+
+class Log2Histogram:
+    """Counts per power of two bucket, sampled log-uniformly within a bucket.
+
+    Bucket 0 holds values below `unit`, bucket k values in
+    [unit * 2**(k-1), unit * 2**k).
+    """
+
+    def __init__(self, unit=1, counts=None):
+        self.unit = unit
+        self.counts = collections.Counter(counts or {})
+
+    def add(self, value):
+        self.counts[self.bucket(value)] += 1
+
+    def bucket(self, value):
+        if value < self.unit:
+            return 0
+        return int(math.log2(value / self.unit)) + 1
+
+    def sample(self, rng):
+        buckets = sorted(self.counts)
+        k = rng.choices(buckets, [self.counts[b] for b in buckets])[0]
+        if k == 0:
+            return 0
+        low = self.unit * 2 ** (k - 1)
+        return low * 2 ** rng.random()
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def todict(self):
+        return {'unit': self.unit, 'counts': {str(k): n for k, n in sorted(self.counts.items())}}
+
+    @classmethod
+    def fromdict(cls, d):
+        return cls(d['unit'], {int(k): n for k, n in d['counts'].items()})
+
+class WorkloadModel:
+    """Distributions fitted from a transfer log: command mix, file size per
+    command, operations per session, think time between operations and the
+    session arrival rate. The model has no paths or user names, so it can
+    be shared where the log can't.
+    """
+
+    def __init__(self, mix=None, sizes=None, session_ops=None, think=None, session_rate=0.0):
+        self.mix = collections.Counter(mix or {})
+        self.sizes = sizes or {}
+        self.session_ops = session_ops or Log2Histogram(1)
+        self.think = think or Log2Histogram(0.001)
+        self.session_rate = session_rate
+
+    @classmethod
+    def fit(cls, entries):
+        """Fit a model from replay.LogEntry records."""
+        model = cls()
+        sessions = collections.defaultdict(list)
+        for entry in entries:
+            if entry.ok:
+                sessions[entry.session].append(entry)
+        for ops in sessions.values():
+            ops.sort()
+            model.session_ops.add(len(ops))
+            for prev, entry in zip(ops, ops[1:]):
+                model.think.add(max(entry.start - (prev.start + prev.duration), 0.0))
+            for entry in ops:
+                model.mix[entry.op] += 1
+                if entry.op in ('retr', 'stor'):
+                    model.sizes.setdefault(entry.op, Log2Histogram(1)).add(entry.size)
+        starts = [ops[0].start for ops in sessions.values()]
+        if len(starts) > 1 and max(starts) > min(starts):
+            model.session_rate = (len(starts) - 1) / (max(starts) - min(starts))
+        return model
+
+    def todict(self):
+        return {
+            'version': MODEL_VERSION,
+            'mix': dict(self.mix),
+            'sizes': {op: hist.todict() for op, hist in self.sizes.items()},
+            'session_ops': self.session_ops.todict(),
+            'think': self.think.todict(),
+            'session_rate': self.session_rate,
+        }
+
+    @classmethod
+    def fromdict(cls, d):
+        if d.get('version') != MODEL_VERSION:
+            raise ValueError(f"unsupported workload model version {d.get('version')!r}")
+        return cls(d['mix'], {op: Log2Histogram.fromdict(h) for op, h in d['sizes'].items()},
+                   Log2Histogram.fromdict(d['session_ops']), Log2Histogram.fromdict(d['think']),
+                   d['session_rate'])
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.todict(), f, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.fromdict(json.load(f))
+
+    def sample_session(self, rng):
+        """Return one session as a list of (think seconds, op, size)."""
+        ops = list(self.mix)
+        weights = [self.mix[op] for op in ops]
+        session = []
+        for i in range(max(int(self.session_ops.sample(rng)), 1)):
+            op = rng.choices(ops, weights)[0]
+            size = int(self.sizes[op].sample(rng)) if op in self.sizes else 0
+            think = self.think.sample(rng) if i and self.think.total() else 0.0
+            session.append((think, op, size))
+        return session
+
+class SyntheticLoad:
+    """Drive load sampled from a WorkloadModel for `duration` seconds.
+
+    Sessions arrive as a Poisson process at the model's session rate times
+    `scale`, up to `max_sessions` at once. Reads go to files seeded per
+    size bucket, writes create new files, deletes and directory commands
+    only touch what the session created itself.
+    """
+
+    def __init__(self, uconfig, model, root, scale=1.0, duration=10, seed=0, max_sessions=64,
+                 client_class=FtpClient):
+        self.uconfig = uconfig
+        self.model = model
+        self.root = root
+        self.scale = scale
+        self.duration = duration
+        self.seed = seed
+        self.max_sessions = max_sessions
+        self.client_class = client_class
+        self.seeded = {}
+        self.created = []
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def new_path(self, prefix):
+        with self.lock:
+            self.counter += 1
+            path = posixpath.join(self.root, f'{prefix}{self.counter:06d}')
+            self.created.append(path)
+        return path
+
+    def seed_files(self, sessions=8):
+        hist = self.model.sizes.get('retr')
+        if hist == None:
+            return
+        self.seeded = {k: posixpath.join(self.root, f'seed{k:02d}') for k in hist.counts}
+        with ClientPool(self.uconfig, sessions, self.client_class) as pool:
+            # the smallest size of its bucket stands for the whole bucket
+            for _, _, err in pool.map(lambda c, k: c.storbinary('stor ' + self.seeded[k],
+                                                                Payload(int(hist.unit * 2 ** (k - 1)) if k else 0).reader()),
+                                      sorted(self.seeded)):
+                if err != None:
+                    raise err
+
+    def run_op(self, client, op, size, owned):
+        if op == 'retr':
+            bucket = self.model.sizes['retr'].bucket(size)
+            client.retrbinary('retr ' + self.seeded[bucket], lambda data: None)
+        elif op == 'stor':
+            path = self.new_path('f')
+            client.storbinary('stor ' + path, Payload(size).reader())
+            owned['files'].append(path)
+        elif op == 'dele':
+            if not owned['files']:
+                path = self.new_path('f')
+                client.upload_fixed_size(path)
+                owned['files'].append(path)
+            client.delete(owned['files'].pop())
+        elif op == 'mkd':
+            path = self.new_path('d')
+            client.mkd(path)
+            owned['dirs'].append(path)
+        elif op == 'rmd':
+            if not owned['dirs']:
+                path = self.new_path('d')
+                client.mkd(path)
+                owned['dirs'].append(path)
+            client.rmd(owned['dirs'].pop())
+
+    def run_session(self, args):
+        due, session = args
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        lag = max(time.perf_counter() - due, 0.0)
+        stats = bench.OpStats()
+        owned = {'files': [], 'dirs': []}
+        client = create_client(self.uconfig, self.client_class)
+        try:
+            client.voidcmd('type i')
+            for think, op, size in session:
+                time.sleep(think)
+                start = time.perf_counter()
+                try:
+                    self.run_op(client, op, size, owned)
+                except ftplib.Error as e:
+                    stats.record(op, 0.0, e)
+                    continue
+                stats.record(op, time.perf_counter() - start)
+        finally:
+            client.close()
+        return stats, lag
+
+    def schedule(self):
+        rng = random.Random(self.seed)
+        rate = self.model.session_rate * self.scale
+        if rate <= 0:
+            raise ValueError('the workload model has no session rate')
+        start = time.perf_counter()
+        t = 0.0
+        sessions = []
+        while True:
+            t += rng.expovariate(rate)
+            if t >= self.duration:
+                return sessions
+            sessions.append((start + t, self.model.sample_session(rng)))
+
+    def run(self):
+        sessions = self.schedule()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.max_sessions) as executor:
+            results = list(executor.map(self.run_session, sessions))
+        elapsed = time.perf_counter() - start
+        stats = bench.OpStats()
+        for session_stats, _ in results:
+            stats.merge(session_stats)
+        start_lag = LatencyHistogram()
+        for _, lag in results:
+            start_lag.record(lag)
+        return stats, start_lag, elapsed, len(sessions)
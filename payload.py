@@ -0,0 +1,137 @@
+import functools
+import hashlib
+import os
+import random
+
+CHUNK_SIZE = 65536
+POOL_SIZE = 1 << 20
+PROFILES = ('random', 'text', 'compressible')
+
+TEXT_WORDS = [
+    b'abcde', b'12345', b'ftp', b'server', b'client', b'data', b'transfer',
+    b'the', b'of', b'and', b'to', b'in', b'file', b'directory', b'log',
+    b'error', b'warning', b'info', b'session', b'user', b'2024-01-01',
+    b'00:00:00', b'GET', b'PUT', b'ok', b'failed', b'retry', b'[main]',
+]
+
+@functools.lru_cache(maxsize=8)
+def get_pool(profile, chunk_size, linesep):
+    # one shared buffer per profile, chunks are views into it; seeds only
+    # move the chunk offsets, so many seeds don't cost a buffer each
+    rng = random.Random(0)
+    pool_len = POOL_SIZE + chunk_size
+    if profile == 'random':
+        return rng.randbytes(pool_len)
+    elif profile == 'text':
+        lines = []
+        total = 0
+        while total < pool_len:
+            line = b' '.join(rng.choices(TEXT_WORDS, k=rng.randint(3, 16))) + linesep
+            lines.append(line)
+            total += len(line)
+        return b''.join(lines)[:pool_len]
+    elif profile == 'compressible':
+        pattern = b'abcde12345'
+        return (pattern * (pool_len // len(pattern) + 1))[:pool_len]
+    raise ValueError(f'unknown payload profile {profile!r}')
+
+def mix(seed, index):
+    # splitmix64 finalizer, cheap and deterministic chunk placement
+    x = (seed * 0x9E3779B97F4A7C15 + index + 1) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return x ^ (x >> 31)
+
+class Payload:
+    """Deterministic payload of `size` bytes built from (seed, profile).
+
+    The payload is never materialized: chunks() yields memoryviews over a
+    pool buffer shared by all seeds of a profile, placed at pseudo random
+    offsets derived from the seed, and digest() streams over them once and caches the result.
+    Text payloads never split a line separator across chunks, so they
+    survive ASCII mode translation.
+    """
+
+    def __init__(self, size, seed=0, profile='random', chunk_size=CHUNK_SIZE,
+                 linesep=bytes(os.linesep, 'ascii')):
+        if profile not in PROFILES:
+            raise ValueError(f'unknown payload profile {profile!r}')
+        self.size = size
+        self.seed = seed
+        self.profile = profile
+        self.chunk_size = chunk_size
+        self.linesep = linesep
+
+    def __len__(self):
+        return self.size
+
+    def chunk_offset(self, pool, index, n):
+        off = mix(self.seed, index) % POOL_SIZE
+        if self.profile == 'text':
+            # don't start inside a line separator or end in the middle of one
+            while pool[off] in self.linesep[1:] or pool[off + n - 1] in self.linesep[:-1]:
+                off = (off + 1) % POOL_SIZE
+        return off
+
+    def chunks(self):
+        pool = memoryview(get_pool(self.profile, self.chunk_size, self.linesep))
+        remaining = self.size
+        index = 0
+        while remaining > 0:
+            n = min(self.chunk_size, remaining)
+            off = self.chunk_offset(pool, index, n)
+            yield pool[off:off + n]
+            remaining -= n
+            index += 1
+
+    def reader(self):
+        return PayloadReader(self)
+
+    def digest(self, algo='sha256'):
+        return expected_digest(self.size, self.seed, self.profile, self.chunk_size,
+                               self.linesep, algo)
+
+    def tobytes(self):
+        return b''.join(self.chunks())
+
+@functools.lru_cache(maxsize=256)
+def expected_digest(size, seed, profile, chunk_size, linesep, algo):
+    sink = DigestSink(algo)
+    for chunk in Payload(size, seed, profile, chunk_size, linesep).chunks():
+        sink.write(chunk)
+    return sink.hexdigest()
+
+class PayloadReader:
+    """File-like view of a Payload for storbinary() and friends."""
+
+    def __init__(self, payload):
+        self.chunks = payload.chunks()
+        self.current = memoryview(b'')
+        self.tell_pos = 0
+
+    def read(self, blocksize=-1):
+        if not self.current:
+            self.current = next(self.chunks, memoryview(b''))
+        if blocksize < 0 or blocksize >= len(self.current):
+            data, self.current = self.current, memoryview(b'')
+        else:
+            data, self.current = self.current[:blocksize], self.current[blocksize:]
+        self.tell_pos += len(data)
+        return data
+
+    def tell(self):
+        return self.tell_pos
+
+class DigestSink:
+    """retrbinary() callback that hashes and counts instead of buffering."""
+
+    def __init__(self, algo='sha256'):
+        self.hash = hashlib.new(algo)
+        self.size = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
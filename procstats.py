@@ -0,0 +1,300 @@
+import contextlib
+import math
+import os
+import threading
+import time
+
+from .histogram import LatencyHistogram
+
+# set by conftest while a test runs with --server_stats
+recorder = None
+
+PROC = '/proc'
+TCP_LISTEN = '0A'
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+@contextlib.contextmanager
+def recording(new_recorder):
+    global recorder
+    saved, recorder = recorder, new_recorder
+    try:
+        yield new_recorder
+    finally:
+        recorder = saved
+
+def listening_inodes(port):
+    inodes = set()
+    for name in (f'{PROC}/net/tcp', f'{PROC}/net/tcp6'):
+        try:
+            with open(name) as f:
+                lines = f.readlines()[1:]
+        except OSError:
+            continue
+        for line in lines:
+            fields = line.split()
+            if fields[3] == TCP_LISTEN and int(fields[1].rsplit(':', 1)[1], 16) == port:
+                inodes.add(fields[9])
+    return inodes
+
+def find_listener_pid(port):
+    """Pid of the local process listening on TCP `port`, or None.
+
+    Needs to read the fd links of the server process, so the harness
+    must run as the same user or as root.
+    """
+    targets = set(f'socket:[{inode}]' for inode in listening_inodes(port))
+    if not targets:
+        return None
+    for pid in pids():
+        try:
+            fds = os.listdir(f'{PROC}/{pid}/fd')
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                if os.readlink(f'{PROC}/{pid}/fd/{fd}') in targets:
+                    return pid
+            except OSError:
+                continue
+    return None
+
+def server_pid(uconfig):
+    """`server_pid` from the config, or the local listener on `server_port`."""
+    if uconfig.get('server_pid') != None:
+        return int(uconfig.get('server_pid'))
+    return find_listener_pid(int(uconfig.get('server_port', 21)))
+
+def pids():
+    return [int(name) for name in os.listdir(PROC) if name.isdigit()]
+
+def read_stat(pid):
+    with open(f'{PROC}/{pid}/stat') as f:
+        # the command name may contain spaces and parentheses
+        fields = f.read().rsplit(')', 1)[1].split()
+    return {
+        'ppid': int(fields[1]),
+        # own and reaped children's time, so the total doesn't drop when
+        # a forking server's session process exits
+        'ticks': sum(int(v) for v in fields[11:15]),
+        'threads': int(fields[17]),
+        'rss': int(fields[21]) * PAGE_SIZE,
+    }
+
+def read_status(pid):
+    voluntary = involuntary = 0
+    with open(f'{PROC}/{pid}/status') as f:
+        for line in f:
+            if line.startswith('voluntary_ctxt_switches'):
+                voluntary = int(line.split()[1])
+            elif line.startswith('nonvoluntary_ctxt_switches'):
+                involuntary = int(line.split()[1])
+    return voluntary, involuntary
+
+def read_io(pid):
+    """Bytes read and written through syscalls, (0, 0) if /proc/<pid>/io is not readable."""
+    counters = {}
+    try:
+        with open(f'{PROC}/{pid}/io') as f:
+            for line in f:
+                key, value = line.split(':')
+                counters[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counters.get('rchar', 0), counters.get('wchar', 0)
+
+def descendants(pid):
+    """`pid` and its descendants, found with one scan of /proc."""
+    children = {}
+    for p in pids():
+        try:
+            children.setdefault(read_stat(p)['ppid'], []).append(p)
+        except OSError:
+            continue
+    found = [pid]
+    for p in found:
+        found.extend(children.get(p, []))
+    return found
+
+def read_usage(tracked):
+    """Counters per process and totals over the processes in `tracked`,
+    the server's first.
+
+    Returns ({pid: (ticks, voluntary, involuntary, read, written)},
+    {'rss', 'fds', 'threads', 'processes'}) and whether any of the other
+    processes was gone.
+    """
+    counters = {}
+    usage = {'rss': 0, 'fds': 0, 'threads': 0, 'processes': 0}
+    gone = False
+    for p in tracked:
+        try:
+            stat = read_stat(p)
+            voluntary, involuntary = read_status(p)
+            fds = len(os.listdir(f'{PROC}/{p}/fd'))
+        except OSError:
+            if p == tracked[0]:
+                raise
+            gone = True
+            continue
+        counters[p] = (stat['ticks'], voluntary, involuntary) + read_io(p)
+        usage['rss'] += stat['rss']
+        usage['threads'] += stat['threads']
+        usage['fds'] += fds
+        usage['processes'] += 1
+    return counters, usage, gone
+
+def counter_deltas(last, counters):
+    """Growth of the summed counters from `last` to `counters`.
+
+    A process seen for the first time only sets its baseline, so the time
+    it ran before it was tracked doesn't show up as one spike. A process
+    that is gone was added to its parent's child time when it was reaped,
+    so what was already counted for it comes off the CPU ticks.
+    """
+    deltas = [0] * 5
+    for p, values in counters.items():
+        if p in last:
+            for i, value in enumerate(values):
+                deltas[i] += value - last[p][i]
+    for p, values in last.items():
+        if p not in counters:
+            deltas[0] -= values[0]
+    return [max(delta, 0) for delta in deltas]
+
+def correlation(xs, ys):
+    n = len(xs)
+    if n < 3:
+        return 0.0
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    syy = sum((y - mean_y) ** 2 for y in ys)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    return sxy / math.sqrt(sxx * syy) if sxx and syy else 0.0
+
+class ServerSampler:
+    """Sample CPU, RSS, open fds, threads, context switches and I/O of a
+    local server process every `interval` seconds from /proc.
+
+    The samples are stamped with time.perf_counter(), the clock of the
+    client side latencies, and each one carries the latencies the client
+    recorded through note() since the previous sample, so spikes on
+    either side line up. With `children` a forking server (vsftpd) is
+    measured with all its session processes.
+
+    Only /proc/<pid>/{stat,status,io,fd} of the tracked processes are
+    read per sample. The process tree is looked up with a scan of /proc
+    at the start, then every `refresh` seconds or when a tracked process
+    is gone. Rates are the growth of each process's counters from when
+    it was first seen (see counter_deltas()). Context switches are the
+    ones of each process's main thread.
+    """
+
+    def __init__(self, pid, interval=0.1, children=True, refresh=5.0):
+        self.pid = pid
+        self.interval = interval
+        self.children = children
+        self.refresh = refresh
+        self.tracked = [pid]
+        self.found_at = None
+        self.samples = []
+        self.error = None
+        self.hist = LatencyHistogram()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def note(self, seconds):
+        """Record a client side latency in the current interval."""
+        with self.lock:
+            self.hist.record(seconds)
+
+    def track(self, force=False):
+        now = time.monotonic()
+        if self.children and (force or now - self.found_at >= self.refresh):
+            self.tracked = descendants(self.pid)
+            self.found_at = now
+
+    def start(self):
+        self.found_at = time.monotonic()
+        if self.children:
+            self.tracked = descendants(self.pid)
+        self.last = (time.perf_counter(), read_usage(self.tracked)[0])
+        self.thread = threading.Thread(target=self.run, name='server-sampler', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.sample()
+            except OSError as e:
+                self.error = str(e)
+                return
+
+    def sample(self):
+        self.track()
+        counters, usage, gone = read_usage(self.tracked)
+        if gone:
+            self.track(force=True)
+        now = time.perf_counter()
+        with self.lock:
+            hist, self.hist = self.hist, LatencyHistogram()
+        then, last = self.last
+        self.last = now, counters
+        seconds = now - then
+        ticks, voluntary, involuntary, read, written = counter_deltas(last, counters)
+        self.samples.append({
+            't': now,
+            'cpu_pct': ticks / CLOCK_TICKS / seconds * 100,
+            'rss_mb': usage['rss'] / 1e6,
+            'fds': usage['fds'],
+            'threads': usage['threads'],
+            'processes': usage['processes'],
+            'voluntary_cs_per_sec': voluntary / seconds,
+            'involuntary_cs_per_sec': involuntary / seconds,
+            'read_mb_per_sec': read / seconds / 1e6,
+            'write_mb_per_sec': written / seconds / 1e6,
+            'ops': len(hist),
+            'p99': hist.percentile(99),
+            'max': hist.max,
+        })
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread != None:
+            self.thread.join()
+        if self.error == None:
+            try:
+                self.sample()
+            except OSError as e:
+                self.error = str(e)
+
+    def results(self):
+        samples = self.samples
+        result = {'pid': self.pid, 'interval': self.interval, 'samples': len(samples)}
+        if self.error != None:
+            result['error'] = self.error
+        if not samples:
+            return result
+        for key in ('cpu_pct', 'voluntary_cs_per_sec', 'involuntary_cs_per_sec',
+                    'read_mb_per_sec', 'write_mb_per_sec'):
+            values = [s[key] for s in samples]
+            result[f'{key}_mean'] = sum(values) / len(values)
+            result[f'{key}_max'] = max(values)
+        for key in ('rss_mb', 'fds', 'threads', 'processes'):
+            result[f'{key}_max'] = max(s[key] for s in samples)
+        result['rss_mb_growth'] = samples[-1]['rss_mb'] - samples[0]['rss_mb']
+        # which server resource moves with the client's tail latency; None
+        # when the latencies were recorded elsewhere (load driver workers,
+        # agents) or too few intervals saw operations
+        busy = [s for s in samples if s['ops']]
+        result['p99_correlation'] = None
+        if len(busy) >= 3:
+            result['p99_correlation'] = {
+                key: correlation([s[key] for s in busy], [s['p99'] for s in busy])
+                for key in ('cpu_pct', 'rss_mb', 'fds', 'threads', 'voluntary_cs_per_sec',
+                            'involuntary_cs_per_sec', 'read_mb_per_sec', 'write_mb_per_sec')
+            }
+        result['series'] = samples
+        return result
@@ -0,0 +1,260 @@
+import cProfile
+import collections
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+class MemoryProfile:
+    """Peak Python memory and top allocation sites of one test.
+
+    The peak is taken relative to the memory traced when the test
+    started. A watcher thread takes a snapshot whenever the traced memory
+    grows past the last snapshot by `growth`, so the sites reported are
+    the largest allocations live at (or close to) the peak, ranked by
+    size, with the frames of pytest, pluggy, tracemalloc and this module
+    left out.
+    """
+
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, '*/pluggy/*'),
+        tracemalloc.Filter(False, '*/_pytest/*'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ]
+
+    def __init__(self, top=5, nframes=1, interval=0.01, growth=1.1):
+        self.top = top
+        self.nframes = nframes
+        self.interval = interval
+        self.growth = growth
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.nframes)
+        tracemalloc.reset_peak()
+        self.base = tracemalloc.get_traced_memory()[0]
+        self.snapshot = tracemalloc.take_snapshot().filter_traces(self.filters)
+        self.peak_snapshot = None
+        self.peak_size = self.base
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.watch, name='memory-watcher', daemon=True)
+        self.thread.start()
+
+    def watch(self):
+        while not self.stopping.wait(self.interval):
+            self.take_if_larger()
+
+    def take_if_larger(self, factor=None):
+        current = tracemalloc.get_traced_memory()[0]
+        if current > self.peak_size * (self.growth if factor == None else factor):
+            self.peak_snapshot = tracemalloc.take_snapshot().filter_traces(self.filters)
+            self.peak_size = current
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        # the end of the test is the peak when memory only grew
+        self.take_if_larger(1.0)
+        current, peak = tracemalloc.get_traced_memory()
+        top = []
+        if self.peak_snapshot != None:
+            stats = [stat for stat in self.peak_snapshot.compare_to(self.snapshot, 'lineno') if stat.size_diff > 0]
+            stats.sort(key=lambda stat: stat.size_diff, reverse=True)
+            for stat in stats[:self.top]:
+                frame = stat.traceback[0]
+                top.append({
+                    'site': f'{frame.filename}:{frame.lineno}',
+                    'size_kb': stat.size_diff / 1024,
+                    'count': stat.count_diff,
+                })
+        self.snapshot = None
+        self.peak_snapshot = None
+        return {
+            'peak_mb': (peak - self.base) / 1e6,
+            'retained_mb': (current - self.base) / 1e6,
+            'top': top,
+        }
+
+PROFILERS = ('off', 'cprofile', 'sample')
+
+def process_cpu():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def thread_times():
+    """User and system CPU seconds of the calling thread."""
+    if hasattr(resource, 'RUSAGE_THREAD'):
+        usage = resource.getrusage(resource.RUSAGE_THREAD)
+        return usage.ru_utime, usage.ru_stime
+    return time.thread_time(), 0.0
+
+def frame_name(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+def write_collapsed(path, stacks):
+    """Write stacks in the collapsed format read by flamegraph.pl and speedscope."""
+    with open(path, 'w') as f:
+        for stack, weight in sorted(stacks.items()):
+            if weight:
+                f.write(f"{';'.join(stack)} {int(weight)}\n")
+
+def pstats_stacks(stats):
+    """Approximate collapsed stacks from cProfile caller edges.
+
+    cProfile only keeps caller/callee pairs, so the self time of a
+    function is split between its callers in proportion to the time each
+    of them spent in it. Weights are in microseconds.
+    """
+    callees = collections.defaultdict(list)
+    roots = []
+    for func, (_, _, tt, ct, callers) in stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, edge in callers.items():
+            callees[caller].append((func, edge[3]))
+    stacks = collections.Counter()
+
+    def name(func):
+        filename, lineno, funcname = func
+        return f'{funcname} ({os.path.basename(filename)}:{lineno})'
+
+    def walk(func, stack, share):
+        _, _, tt, ct, _ = stats[func]
+        stack = stack + (name(func),)
+        stacks[stack] += tt * share * 1e6
+        for callee, edge_ct in callees[func]:
+            # prune recursion and paths below 10us
+            if callee in path_funcs or share * edge_ct < 1e-5:
+                continue
+            path_funcs.add(callee)
+            walk(callee, stack, share * edge_ct / stats[callee][3])
+            path_funcs.discard(callee)
+
+    for root in roots:
+        path_funcs = {root}
+        walk(root, (), 1.0)
+    return stacks
+
+class StackSampler:
+    """Sample the stacks of every thread at a fixed interval.
+
+    It samples wall clock time: threads blocked on a server reply show up
+    in recv() just like threads burning CPU show up in the parser.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.cpu = 0.0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='stack-sampler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def run(self):
+        me = threading.get_ident()
+        start = time.thread_time()
+        try:
+            self.sample(me)
+        finally:
+            # the sampler's own CPU time, not to be billed to the test
+            self.cpu = time.thread_time() - start
+
+    def sample(self, me):
+        while not self.stopping.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame != None:
+                    stack.append(frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[tuple(reversed(stack))] += 1
+
+class CpuProfile:
+    """Profile one test call and split its wall time from its CPU time.
+
+    'cprofile' traces every call of the test thread only, 'sample' samples
+    all threads, including the ClientPool workers. Both write collapsed
+    stacks next to their native output.
+
+    `cpu`, `user`, `system` and `cpu_pct` are the test thread's own CPU
+    time and its share of the wall time: 100% means the test thread never
+    waited. With 'cprofile' they include the tracing overhead, which runs
+    in the test thread. `process_cpu` and `process_cpu_pct` count every
+    thread of the process, ClientPool workers included, minus the stack
+    sampler's own time, so they may exceed 100%.
+    """
+
+    def __init__(self, mode, interval=0.005, top=5):
+        self.mode = mode
+        self.interval = interval
+        self.top = top
+        self.profiler = None
+
+    def start(self):
+        if self.mode == 'cprofile':
+            self.profiler = cProfile.Profile()
+        else:
+            self.profiler = StackSampler(self.interval)
+        self.process_cpu = process_cpu()
+        self.thread_times = thread_times()
+        self.wall = time.perf_counter()
+        if self.mode == 'cprofile':
+            self.profiler.enable()
+        else:
+            self.profiler.start()
+
+    def stop(self, path_base):
+        if self.mode == 'cprofile':
+            self.profiler.disable()
+        else:
+            self.profiler.stop()
+        wall = time.perf_counter() - self.wall
+        user, system = (b - a for a, b in zip(self.thread_times, thread_times()))
+        process = process_cpu() - self.process_cpu
+        if self.mode == 'sample':
+            process = max(process - self.profiler.cpu, 0.0)
+        files = []
+        if self.mode == 'cprofile':
+            files.append(path_base + '.prof')
+            self.profiler.dump_stats(files[-1])
+            stacks = pstats_stacks(pstats.Stats(self.profiler).stats)
+        else:
+            stacks = self.profiler.stacks
+        files.append(path_base + '.folded')
+        write_collapsed(files[-1], stacks)
+        self_weight = collections.Counter()
+        for stack, weight in stacks.items():
+            self_weight[stack[-1]] += weight
+        total = sum(self_weight.values()) or 1
+        self.profiler = None
+        return {
+            'wall': wall,
+            'cpu': user + system,
+            'user': user,
+            'system': system,
+            'cpu_pct': (user + system) / wall * 100 if wall else 0.0,
+            'process_cpu': process,
+            'process_cpu_pct': process / wall * 100 if wall else 0.0,
+            'top': [{'func': func, 'self_pct': weight / total * 100}
+                    for func, weight in self_weight.most_common(self.top)],
+            'files': files,
+        }
@@ -0,0 +1,220 @@
+import calendar
+import collections
+import ftplib
+import posixpath
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import bench
+from .histogram import LatencyHistogram, SignedHistogram
+from .client import FtpClient, ClientPool, create_client
+from .payload import Payload
+
+LogEntry = collections.namedtuple('LogEntry', 'start duration session op path size ok')
+
+XFERLOG_OPS = {'o': 'retr', 'i': 'stor', 'd': 'dele'}
+VSFTPD_OPS = {'DOWNLOAD': 'retr', 'UPLOAD': 'stor', 'DELETE': 'dele', 'MKDIR': 'mkd', 'RMDIR': 'rmd'}
+VSFTPD_LINE = re.compile(
+    r'^(?P<date>\w{3} \w{3} +\d+ [\d:]{8} \d{4}) \[pid (?P<pid>\d+)\]'
+    r'(?: \[(?P<user>[^\]]*)\])? (?P<status>OK|FAIL) (?P<verb>[A-Z]+): Client "(?P<host>[^"]*)"'
+    r'(?:, "(?P<path>[^"]*)")?(?:, (?P<size>\d+) bytes)?(?:, (?P<rate>[\d.]+)Kbyte/sec)?')
+
+def parse_date(text):
+    # the logs carry local time without a zone, only differences matter
+    return calendar.timegm(time.strptime(' '.join(text.split()), '%a %b %d %H:%M:%S %Y'))
+
+def parse_xferlog(lines, session_gap=60):
+    """Parse the xferlog format of wu-ftpd, proftpd and vsftpd.
+
+    xferlog has no session ids, so the transfers of one host and user
+    are a session until they pause for more than `session_gap` seconds.
+    """
+    entries = []
+    last_end = {}
+    sessions = collections.Counter()
+    for line in lines:
+        tokens = line.split()
+        if len(tokens) < 17:
+            continue
+        # transfer-type ... authenticated-user-id, plus the completion
+        # status of the newer format
+        trailer = 9 if tokens[-1] in ('c', 'i') else 8
+        end = parse_date(' '.join(tokens[:5]))
+        duration = float(tokens[5])
+        host, size = tokens[6], int(tokens[7])
+        path = ' '.join(tokens[8:-trailer])
+        direction, user = tokens[-trailer + 2], tokens[-trailer + 4]
+        op = XFERLOG_OPS.get(direction)
+        if op == None:
+            continue
+        key = (host, user)
+        start = end - duration
+        if key in last_end and start - last_end[key] > session_gap:
+            sessions[key] += 1
+        last_end[key] = max(end, last_end.get(key, end))
+        ok = trailer == 8 or tokens[-1] == 'c'
+        entries.append(LogEntry(start, duration, f'{host}/{user}/{sessions[key]}', op, path, size, ok))
+    return sorted(entries)
+
+def parse_vsftpd_log(lines):
+    """Parse vsftpd's own log format (vsftpd.log), sessions are vsftpd pids.
+
+    The log has the completion time and the average rate of a transfer,
+    its start is derived from them.
+    """
+    entries = []
+    for line in lines:
+        match = VSFTPD_LINE.match(line)
+        if match == None or match['verb'] not in VSFTPD_OPS or match['path'] == None:
+            continue
+        end = parse_date(match['date'])
+        size = int(match['size'] or 0)
+        rate = float(match['rate'] or 0) * 1024
+        duration = size / rate if rate else 0.0
+        entries.append(LogEntry(end - duration, duration, match['pid'], VSFTPD_OPS[match['verb']],
+                                match['path'], size, match['status'] == 'OK'))
+    return sorted(entries)
+
+def parse_log(path, session_gap=60):
+    """Parse an xferlog or vsftpd log, telling them apart by the first lines."""
+    with open(path, errors='replace') as f:
+        lines = f.readlines()
+    if any(VSFTPD_LINE.match(line) for line in lines[:100]):
+        return parse_vsftpd_log(lines)
+    return parse_xferlog(lines, session_gap)
+
+class Replayer:
+    """Re-issue the sessions of a transfer log against the test server.
+
+    Every recorded session gets its own harness session and runs its
+    operations at their recorded offsets divided by `speedup`; when a
+    session falls behind, its operations start right away and the lag is
+    reported. Recorded paths are mapped to flat names under `root`, and
+    files that are read or deleted are seeded first with a Payload of the
+    largest size the log shows for them. Only successful operations of
+    the log are replayed.
+    """
+
+    def __init__(self, uconfig, entries, root, speedup=1.0, max_sessions=64, client_class=FtpClient):
+        self.uconfig = uconfig
+        self.entries = [e for e in entries if e.ok]
+        self.root = root
+        self.speedup = speedup
+        self.max_sessions = max_sessions
+        self.client_class = client_class
+        self.paths = {}
+        self.dirs = {}
+        for entry in self.entries:
+            names = self.dirs if entry.op in ('mkd', 'rmd') else self.paths
+            if entry.path not in names:
+                prefix = 'd' if names is self.dirs else 'f'
+                names[entry.path] = posixpath.join(root, f'{prefix}{len(names):06d}')
+
+    def seed_files(self, sessions=8):
+        sizes = {}
+        stored = set()
+        for entry in self.entries:
+            if entry.op == 'stor':
+                stored.add(entry.path)
+            elif entry.path not in stored and entry.op in ('retr', 'dele'):
+                sizes[entry.path] = max(sizes.get(entry.path, 0), entry.size)
+        with ClientPool(self.uconfig, sessions, self.client_class) as pool:
+            for _, _, err in pool.map(lambda c, item: c.storbinary('stor ' + self.paths[item[0]],
+                                                                   Payload(item[1]).reader()),
+                                      sorted(sizes.items())):
+                if err != None:
+                    raise err
+
+    def run_op(self, client, entry):
+        path = self.dirs.get(entry.path) if entry.op in ('mkd', 'rmd') else self.paths[entry.path]
+        if entry.op == 'retr':
+            client.retrbinary('retr ' + path, lambda data: None)
+        elif entry.op == 'stor':
+            client.storbinary('stor ' + path, Payload(entry.size).reader())
+        elif entry.op == 'dele':
+            client.delete(path)
+        elif entry.op == 'mkd':
+            client.mkd(path)
+        elif entry.op == 'rmd':
+            client.rmd(path)
+
+    def run_session(self, entries):
+        stats = bench.OpStats()
+        lag = LatencyHistogram()
+        deltas = collections.defaultdict(SignedHistogram)
+        self.wait_until(entries[0].start)
+        client = create_client(self.uconfig, self.client_class)
+        try:
+            client.voidcmd('type i')
+            for entry in entries:
+                due = self.wait_until(entry.start)
+                lag.record(max(time.perf_counter() - due, 0.0))
+                start = time.perf_counter()
+                try:
+                    self.run_op(client, entry)
+                except ftplib.Error as e:
+                    stats.record(entry.op, 0.0, e)
+                    continue
+                seconds = time.perf_counter() - start
+                stats.record(entry.op, seconds)
+                deltas[entry.op].record(seconds - entry.duration)
+        finally:
+            client.close()
+        return stats, lag, deltas
+
+    def wait_until(self, log_time):
+        """Sleep until the replay time of `log_time`, return that time."""
+        due = self.run_start + (log_time - self.log_start) / self.speedup
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        return due
+
+    def run(self):
+        sessions = collections.defaultdict(list)
+        for entry in self.entries:
+            sessions[entry.session].append(entry)
+        self.log_start = self.entries[0].start if self.entries else 0.0
+        self.run_start = time.perf_counter()
+        with ThreadPoolExecutor(self.max_sessions) as executor:
+            results = list(executor.map(self.run_session, sessions.values()))
+        elapsed = time.perf_counter() - self.run_start
+        stats = bench.OpStats()
+        lag = LatencyHistogram()
+        deltas = collections.defaultdict(SignedHistogram)
+        for session_stats, session_lag, session_deltas in results:
+            stats.merge(session_stats)
+            lag.merge(session_lag)
+            for op, hist in session_deltas.items():
+                deltas[op].merge(hist)
+        return ReplayResult(self.entries, stats, lag, deltas, elapsed, len(sessions))
+
+class ReplayResult:
+    def __init__(self, entries, stats, lag, deltas, elapsed, sessions):
+        self.entries = entries
+        self.stats = stats
+        self.lag = lag
+        self.deltas = deltas
+        self.elapsed = elapsed
+        self.sessions = sessions
+
+    def comparison(self):
+        """Recorded against replayed latency per operation."""
+        recorded = collections.defaultdict(list)
+        for entry in self.entries:
+            recorded[entry.op].append(entry.duration)
+        result = {}
+        for op, summary in self.stats.summary(self.elapsed).items():
+            rec = bench.summarize(recorded[op])
+            result[op] = {
+                'count': summary['count'],
+                'recorded_p50': rec['p50'],
+                'replayed_p50': summary['p50'],
+                'recorded_p99': rec['p99'],
+                'replayed_p99': summary['p99'],
+                'p50_ratio': summary['p50'] / rec['p50'] if rec['p50'] else 0.0,
+                'delta_p50': self.deltas[op].percentile(50),
+                'errors': summary['errors'],
+            }
+        return result
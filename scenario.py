@@ -0,0 +1,449 @@
+import collections
+import copy
+import ftplib
+import itertools
+import json
+import os
+import posixpath
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import bench
+from .histogram import LatencyHistogram
+from .client import FtpClient, ClientPool, create_client
+from .payload import Payload
+
+OPS = ('list', 'nlst', 'mlsd', 'retr', 'stor', 'dele', 'rename', 'mkd', 'rmd')
+SIZED_OPS = ('retr', 'stor')
+# files each session cycles through for STOR, DELE and RENAME
+SESSION_FILES = 4
+MODES = ('closed', 'open')
+ARRIVALS = ('uniform', 'poisson')
+
+# sessions and rate are (from, to) pairs, equal unless the phase ramps
+Phase = collections.namedtuple('Phase', 'name duration sessions rate')
+
+def load_scenario(path):
+    """Load a scenario from a .yaml/.yml or .json file."""
+    with open(path) as f:
+        if os.path.splitext(path)[1] in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError(f'PyYAML is needed to read {path}, or write the scenario as JSON')
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    return Scenario(data, name=os.path.splitext(os.path.basename(path))[0])
+
+def ramp(spec):
+    """Parse a count or a [from, to] ramp into a (from, to) pair."""
+    if isinstance(spec, (list, tuple)):
+        return float(spec[0]), float(spec[1])
+    return float(spec), float(spec)
+
+def think_time(spec):
+    """Parse a think time, a number of seconds or {min: .., max: ..}."""
+    if isinstance(spec, dict):
+        return float(spec.get('min', 0)), float(spec.get('max', spec.get('min', 0)))
+    return float(spec), float(spec)
+
+class Scenario:
+    """A workload described as data.
+
+    Example (YAML)::
+
+        sessions: 16
+        think_time: {min: 0, max: 0.05}
+        size_classes: {small: 4096, large: 4194304}
+        operations:
+          - {op: list, weight: 10}
+          - {op: retr, size: small, weight: 50}
+          - {op: stor, size: large, weight: 5}
+          - {op: rename, weight: 5}
+        phases:
+          - {name: ramp_up, duration: 5, sessions: [1, 16]}
+          - {name: steady, duration: 30}
+          - {name: ramp_down, duration: 5, sessions: [16, 1]}
+
+    A phase's `sessions` is a count or a [from, to] linear ramp, and
+    defaults to the scenario's. Without phases the scenario runs one
+    steady phase of `duration` seconds.
+
+    With `mode: open` operations are started at `rate` per second
+    (a count or a ramp, per phase or for the whole scenario) no matter
+    how fast the server answers, spaced evenly or, with
+    `arrivals: poisson`, at random. `sessions` is then the largest
+    number of operations in flight, think times don't apply.
+    """
+
+    def __init__(self, data, name='scenario'):
+        # kept to send the scenario to load agents
+        self.data = data
+        self.name = data.get('name', name)
+        self.seed = data.get('seed', 0)
+        self.think = think_time(data.get('think_time', 0))
+        self.size_classes = {k: int(v) for k, v in data.get('size_classes', {}).items()}
+        self.files_per_class = data.get('files_per_class', 4)
+        self.list_files = data.get('list_files', 100)
+        self.operations = []
+        for item in data.get('operations', []):
+            op = item['op'].lower()
+            if op not in OPS:
+                raise ValueError(f'{self.name}: unknown operation {op!r}')
+            size = item.get('size')
+            if op in SIZED_OPS and size not in self.size_classes:
+                raise ValueError(f'{self.name}: {op} needs a size from size_classes, got {size!r}')
+            label = f'{op}_{size}' if op in SIZED_OPS else op
+            self.operations.append((label, op, size, float(item.get('weight', 1))))
+        if not self.operations:
+            raise ValueError(f'{self.name}: no operations')
+        self.mode = data.get('mode', 'closed')
+        if self.mode not in MODES:
+            raise ValueError(f'{self.name}: mode must be one of {MODES}, got {self.mode!r}')
+        self.arrivals = data.get('arrivals', 'uniform')
+        if self.arrivals not in ARRIVALS:
+            raise ValueError(f'{self.name}: arrivals must be one of {ARRIVALS}, got {self.arrivals!r}')
+        sessions = data.get('sessions', 1)
+        rate = data.get('rate', 0)
+        self.phases = []
+        for phase in data.get('phases') or [{'name': 'steady', 'duration': data.get('duration', 10)}]:
+            self.phases.append(Phase(phase.get('name', f'phase{len(self.phases)}'), float(phase['duration']),
+                                     ramp(phase.get('sessions', sessions)), ramp(phase.get('rate', rate))))
+        if self.mode == 'open' and not any(max(phase.rate) > 0 for phase in self.phases):
+            raise ValueError(f'{self.name}: open mode needs a rate')
+        self.max_sessions = int(max(max(phase.sessions) for phase in self.phases))
+        self.shard_index = 0
+        self.shard_count = 1
+
+    def shard(self, index, count):
+        """The part of the scenario run by load driver worker `index` of `count`.
+
+        The worker runs every count-th session (closed mode) or every
+        count-th operation of the schedule (open mode) of the whole
+        scenario, starting at `index`, and gets 1/count of the operations
+        in flight. Together the parts run exactly the unsharded scenario,
+        so open mode arrivals stay evenly spread instead of firing in
+        lockstep on every worker.
+        """
+        part = copy.copy(self)
+        part.shard_index = index
+        part.shard_count = count
+        part.max_sessions = max(len(range(index, self.max_sessions, count)), 1)
+        return part
+
+    def session_number(self, index):
+        """Number in the unsharded scenario of this part's session `index`."""
+        return self.shard_index + index * self.shard_count
+
+    def duration(self):
+        return sum(phase.duration for phase in self.phases)
+
+    def target(self, elapsed):
+        """Phase name and number of sessions that should be active at `elapsed`."""
+        offset = 0.0
+        for phase in self.phases:
+            if elapsed < offset + phase.duration:
+                start, end = phase.sessions
+                sessions = round(start + (end - start) * (elapsed - offset) / phase.duration)
+                return phase.name, len(range(self.shard_index, sessions, self.shard_count))
+            offset += phase.duration
+        return None, 0
+
+    def schedule(self):
+        """Intended start offsets and phases of the operations of an open run."""
+        return self.full_schedule()[self.shard_index::self.shard_count]
+
+    def full_schedule(self):
+        """schedule() of the unsharded scenario."""
+        rng = random.Random(self.seed)
+        plan = []
+        offset = 0.0
+        for phase in self.phases:
+            start, end = phase.rate
+            t = 0.0
+            while True:
+                rate = start + (end - start) * t / phase.duration
+                if rate <= 0:
+                    # a ramp up from zero: move on until there is a rate
+                    t += phase.duration / 1000
+                else:
+                    t += rng.expovariate(rate) if self.arrivals == 'poisson' else 1.0 / rate
+                if t >= phase.duration:
+                    break
+                if rate > 0:
+                    plan.append((offset + t, phase.name))
+            offset += phase.duration
+        return plan
+
+class Progress:
+    """Results of a running scenario, taken in pieces while it runs.
+
+    Sessions record into it next to their own OpStats; take() returns
+    what was recorded since the previous take() per phase.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {}
+
+    def record(self, phase, op, seconds, err=None):
+        with self.lock:
+            self.phases.setdefault(phase, bench.OpStats()).record(op, seconds, err)
+
+    def take(self):
+        with self.lock:
+            phases, self.phases = self.phases, {}
+        return phases
+
+class ProgressStats(bench.OpStats):
+    """OpStats of one session and phase that also feeds a Progress."""
+
+    def __init__(self, progress, phase):
+        super().__init__()
+        self.progress = progress
+        self.phase = phase
+
+    def record(self, op, seconds, err=None):
+        super().record(op, seconds, err)
+        self.progress.record(self.phase, op, seconds, err)
+
+class ScenarioRunner:
+    """Run a Scenario with harness sessions under `root`.
+
+    Session i is logged in while the current phase wants more than i
+    sessions and logged out otherwise, so ramps add and remove sessions.
+    Every session loops: pick an operation by weight, run it, think.
+    Results are recorded per phase, and into `progress` too when it is
+    set to a Progress.
+    """
+
+    def __init__(self, uconfig, scenario, root, client_class=FtpClient):
+        self.uconfig = uconfig
+        self.scenario = scenario
+        self.root = root
+        self.client_class = client_class
+        self.seeded = {}
+        self.list_dir = posixpath.join(root, 'list')
+        self.created = []
+        self.dirs = [self.list_dir]
+        self.lock = threading.Lock()
+        self.progress = None
+
+    def phase_stats(self, stats, phase):
+        if phase not in stats:
+            stats[phase] = bench.OpStats() if self.progress == None else ProgressStats(self.progress, phase)
+        return stats[phase]
+
+    def prepare(self, client, sessions=8):
+        used = set(op for _, op, _, _ in self.scenario.operations)
+        client.mkd(self.list_dir)
+        files = []
+        if used & {'list', 'nlst', 'mlsd'}:
+            files += [(posixpath.join(self.list_dir, f'l{i:05d}'), 0) for i in range(self.scenario.list_files)]
+        for size_class in set(size for _, op, size, _ in self.scenario.operations if op == 'retr'):
+            self.seeded[size_class] = [posixpath.join(self.root, f'{size_class}{i:03d}')
+                                       for i in range(self.scenario.files_per_class)]
+            files += [(path, self.scenario.size_classes[size_class]) for path in self.seeded[size_class]]
+        with self.lock:
+            self.created += [path for path, _ in files]
+        with ClientPool(self.uconfig, sessions, self.client_class) as pool:
+            for _, _, err in pool.map(lambda c, item: c.storbinary('stor ' + item[0], Payload(item[1]).reader()),
+                                      files):
+                if err != None:
+                    raise err
+
+    def session_path(self, index, n, prefix='f'):
+        # files are reused in a small ring, directories get fresh names
+        # since MKD of an existing one fails
+        suffix = n if prefix == 'd' else n % SESSION_FILES
+        path = posixpath.join(self.root, f'{prefix}{index:04d}-{suffix}')
+        with self.lock:
+            if prefix == 'd':
+                if path not in self.dirs:
+                    self.dirs.append(path)
+            elif path not in self.created:
+                self.created.append(path)
+        return path
+
+    def run_op(self, client, index, state, op, size, rng):
+        if op in ('list', 'nlst', 'mlsd'):
+            client.retrlines(f'{op} {self.list_dir}', lambda line: None)
+        elif op == 'retr':
+            client.retrbinary('retr ' + rng.choice(self.seeded[size]), lambda data: None)
+        elif op == 'stor':
+            state['n'] += 1
+            path = self.session_path(index, state['n'])
+            client.storbinary('stor ' + path, Payload(self.scenario.size_classes[size], seed=index).reader())
+            state['files'].add(path)
+        elif op in ('dele', 'rename'):
+            if not state['files']:
+                state['n'] += 1
+                path = self.session_path(index, state['n'])
+                client.upload_fixed_size(path)
+                state['files'].add(path)
+            path = state['files'].pop()
+            if op == 'dele':
+                client.delete(path)
+            else:
+                client.rename(path, path + '~')
+                client.rename(path + '~', path)
+                state['files'].add(path)
+        elif op == 'mkd':
+            state['n'] += 1
+            path = self.session_path(index, state['n'], 'd')
+            client.mkd(path)
+            state['dirs'].add(path)
+        elif op == 'rmd':
+            if not state['dirs']:
+                state['n'] += 1
+                path = self.session_path(index, state['n'], 'd')
+                client.mkd(path)
+                state['dirs'].add(path)
+            client.rmd(state['dirs'].pop())
+
+    def run_session(self, index):
+        rng = random.Random(self.scenario.seed * 1000003 + self.scenario.session_number(index))
+        labels = [label for label, _, _, _ in self.scenario.operations]
+        weights = [weight for _, _, _, weight in self.scenario.operations]
+        ops = {label: (op, size) for label, op, size, _ in self.scenario.operations}
+        stats = {}
+        state = {'n': 0, 'files': set(), 'dirs': set()}
+        client = None
+        try:
+            while True:
+                phase, target = self.scenario.target(time.perf_counter() - self.start)
+                if phase == None:
+                    break
+                if index >= target:
+                    if client != None:
+                        client.close()
+                        client = None
+                    time.sleep(0.05)
+                    continue
+                phase_stats = self.phase_stats(stats, phase)
+                if client == None:
+                    start = time.perf_counter()
+                    try:
+                        client = create_client(self.uconfig, self.client_class)
+                        client.voidcmd('type i')
+                    except ftplib.all_errors as e:
+                        phase_stats.record('login', 0.0, e)
+                        client = None
+                        time.sleep(0.05)
+                        continue
+                    phase_stats.record('login', time.perf_counter() - start)
+                label = rng.choices(labels, weights)[0]
+                op, size = ops[label]
+                start = time.perf_counter()
+                try:
+                    self.run_op(client, index, state, op, size, rng)
+                except ftplib.Error as e:
+                    phase_stats.record(label, 0.0, e)
+                except ftplib.all_errors as e:
+                    # the session is probably gone, log in again
+                    phase_stats.record(label, 0.0, e)
+                    client.close()
+                    client = None
+                else:
+                    phase_stats.record(label, time.perf_counter() - start)
+                low, high = self.scenario.think
+                if high > 0:
+                    time.sleep(rng.uniform(low, high))
+        finally:
+            if client != None:
+                client.close()
+        return stats
+
+    def run_open_session(self, index):
+        # latency counts from the intended start, so time spent waiting
+        # for a free session is not hidden (coordinated omission)
+        rng = random.Random(self.scenario.seed * 1000003 + self.scenario.session_number(index))
+        labels = [label for label, _, _, _ in self.scenario.operations]
+        weights = [weight for _, _, _, weight in self.scenario.operations]
+        ops = {label: (op, size) for label, op, size, _ in self.scenario.operations}
+        stats = {}
+        service = collections.defaultdict(bench.OpStats)
+        lag = collections.defaultdict(LatencyHistogram)
+        state = {'n': 0, 'files': set(), 'dirs': set()}
+        client = None
+        try:
+            while True:
+                i = next(self.next_op)
+                if i >= len(self.plan):
+                    break
+                offset, phase = self.plan[i]
+                due = self.start + offset
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                label = rng.choices(labels, weights)[0]
+                op, size = ops[label]
+                if client == None:
+                    try:
+                        client = create_client(self.uconfig, self.client_class)
+                        client.voidcmd('type i')
+                    except ftplib.all_errors as e:
+                        self.phase_stats(stats, phase).record(label, 0.0, e)
+                        client = None
+                        continue
+                start = time.perf_counter()
+                lag[phase].record(max(start - due, 0.0))
+                try:
+                    self.run_op(client, index, state, op, size, rng)
+                except ftplib.Error as e:
+                    self.phase_stats(stats, phase).record(label, 0.0, e)
+                    continue
+                except ftplib.all_errors as e:
+                    self.phase_stats(stats, phase).record(label, 0.0, e)
+                    client.close()
+                    client = None
+                    continue
+                end = time.perf_counter()
+                self.phase_stats(stats, phase).record(label, end - due)
+                service[phase].record(label, end - start)
+        finally:
+            if client != None:
+                client.close()
+        return stats, service, lag
+
+    def run_open(self):
+        self.plan = self.scenario.schedule()
+        self.next_op = itertools.count()
+        self.start = time.perf_counter()
+        with ThreadPoolExecutor(self.scenario.max_sessions) as executor:
+            results = list(executor.map(self.run_open_session, range(self.scenario.max_sessions)))
+        self.elapsed = time.perf_counter() - self.start
+        merged = {}
+        for session_stats, session_service, session_lag in results:
+            for phase, stats in session_stats.items():
+                merged.setdefault(phase, bench.OpStats()).merge(stats)
+            for phase, stats in session_service.items():
+                self.service.setdefault(phase, bench.OpStats()).merge(stats)
+            for phase, hist in session_lag.items():
+                self.lag.setdefault(phase, LatencyHistogram()).merge(hist)
+        return merged
+
+    def run(self):
+        """Run all phases, return {phase: OpStats} and {phase: seconds}.
+
+        In open mode the latencies count from the intended start of each
+        operation, and `service` (latency from the actual start) and `lag`
+        (actual start behind the schedule) are kept per phase.
+        """
+        self.service = {}
+        self.lag = {}
+        durations = {phase.name: phase.duration for phase in self.scenario.phases}
+        if self.scenario.mode == 'open':
+            return self.run_open(), durations
+        self.start = time.perf_counter()
+        with ThreadPoolExecutor(self.scenario.max_sessions) as executor:
+            results = list(executor.map(self.run_session, range(self.scenario.max_sessions)))
+        self.elapsed = time.perf_counter() - self.start
+        merged = {}
+        for session_stats in results:
+            for phase, stats in session_stats.items():
+                merged.setdefault(phase, bench.OpStats()).merge(stats)
+        return merged, durations
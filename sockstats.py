@@ -0,0 +1,195 @@
+import contextlib
+import socket
+import struct
+import time
+
+# set by conftest while a test runs with --socket_stats
+recorder = None
+
+# struct tcp_info of linux/tcp.h up to tcpi_total_retrans
+TCP_INFO = struct.Struct('8B24I')
+TCP_INFO_FIELDS = {
+    'retransmits': 2,
+    'rto_us': 8,
+    'snd_mss': 10,
+    'unacked': 12,
+    'lost': 14,
+    'retrans': 15,
+    'rtt_us': 23,
+    'rttvar_us': 24,
+    'snd_ssthresh': 25,
+    'snd_cwnd': 26,
+    'total_retrans': 31,
+}
+
+@contextlib.contextmanager
+def recording(new_recorder):
+    global recorder
+    saved, recorder = recorder, new_recorder
+    try:
+        yield new_recorder
+    finally:
+        recorder = saved
+
+def tcp_info(sock):
+    """RTT, retransmits and congestion window of a TCP socket, None where unsupported."""
+    opt = getattr(socket, 'TCP_INFO', None)
+    if opt == None:
+        return None
+    try:
+        raw = sock.getsockopt(socket.IPPROTO_TCP, opt, TCP_INFO.size)
+    except OSError:
+        return None
+    if len(raw) < TCP_INFO.size:
+        return None
+    values = TCP_INFO.unpack(raw)
+    return {name: values[i] for name, i in TCP_INFO_FIELDS.items()}
+
+class SocketCounter:
+    """Syscalls, bytes and blocked time of one connection."""
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.send_calls = 0
+        self.send_bytes = 0
+        self.send_blocked = 0.0
+        self.partial_writes = 0
+        self.recv_calls = 0
+        self.recv_bytes = 0
+        self.recv_blocked = 0.0
+        self.tcp_info = None
+
+    def merge(self, other):
+        self.send_calls += other.send_calls
+        self.send_bytes += other.send_bytes
+        self.send_blocked += other.send_blocked
+        self.partial_writes += other.partial_writes
+        self.recv_calls += other.recv_calls
+        self.recv_bytes += other.recv_bytes
+        self.recv_blocked += other.recv_blocked
+
+    def metrics(self):
+        return {
+            'kind': self.kind,
+            'name': self.name,
+            'send_calls': self.send_calls,
+            'send_bytes': self.send_bytes,
+            'avg_send': self.send_bytes / self.send_calls if self.send_calls else 0.0,
+            'partial_writes': self.partial_writes,
+            'send_blocked': self.send_blocked,
+            'recv_calls': self.recv_calls,
+            'recv_bytes': self.recv_bytes,
+            'avg_recv': self.recv_bytes / self.recv_calls if self.recv_calls else 0.0,
+            'recv_blocked': self.recv_blocked,
+            'tcp_info': self.tcp_info,
+        }
+
+def totals(counters):
+    """Sum the counters of many connections, TCP_INFO is averaged."""
+    total = SocketCounter(None, None)
+    for counter in counters:
+        total.merge(counter)
+    result = total.metrics()
+    del result['kind'], result['name'], result['tcp_info']
+    result['connections'] = len(counters)
+    infos = [c.tcp_info for c in counters if c.tcp_info != None]
+    if infos:
+        result['tcp_info'] = {
+            'avg_rtt_us': sum(i['rtt_us'] for i in infos) / len(infos),
+            'max_rtt_us': max(i['rtt_us'] for i in infos),
+            'total_retrans': sum(i['total_retrans'] for i in infos),
+            'avg_snd_cwnd': sum(i['snd_cwnd'] for i in infos) / len(infos),
+        }
+    return result
+
+class SocketRecorder:
+    def __init__(self):
+        self.counters = []
+
+    def new_counter(self, kind, name):
+        counter = SocketCounter(kind, name)
+        self.counters.append(counter)
+        return counter
+
+    def results(self):
+        kinds = {}
+        for counter in self.counters:
+            kinds.setdefault(counter.kind, []).append(counter)
+        result = {kind: totals(counters) for kind, counters in kinds.items()}
+        result['per_connection'] = [c.metrics() for c in self.counters]
+        return result
+
+class CountedSocket:
+    """Socket proxy counting the send and recv calls made on it.
+
+    sendall() is split into send() calls so that partial writes show up.
+    Files from makefile() read and write through the proxy, which covers
+    ftplib's control channel and retrlines(). TCP_INFO is sampled when the
+    socket is closed.
+    """
+
+    _io_refs = 0
+
+    def __init__(self, sock, counter):
+        self.sock = sock
+        self.counter = counter
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def makefile(self, mode='r', buffering=None, **kwargs):
+        return socket.socket.makefile(self, mode, buffering, **kwargs)
+
+    def _decref_socketios(self):
+        if self._io_refs > 0:
+            self._io_refs -= 1
+
+    def recv(self, bufsize, *flags):
+        start = time.perf_counter()
+        try:
+            data = self.sock.recv(bufsize, *flags)
+        finally:
+            self.counter.recv_blocked += time.perf_counter() - start
+            self.counter.recv_calls += 1
+        self.counter.recv_bytes += len(data)
+        return data
+
+    def recv_into(self, buffer, *args):
+        start = time.perf_counter()
+        try:
+            n = self.sock.recv_into(buffer, *args)
+        finally:
+            self.counter.recv_blocked += time.perf_counter() - start
+            self.counter.recv_calls += 1
+        self.counter.recv_bytes += n
+        return n
+
+    def send(self, data, *flags):
+        start = time.perf_counter()
+        try:
+            n = self.sock.send(data, *flags)
+        finally:
+            self.counter.send_blocked += time.perf_counter() - start
+            self.counter.send_calls += 1
+        self.counter.send_bytes += n
+        if n < len(data):
+            self.counter.partial_writes += 1
+        return n
+
+    def sendall(self, data, *flags):
+        view = memoryview(data).cast('B')
+        while view:
+            n = self.send(view, *flags)
+            view = view[n:]
+
+    def close(self):
+        if self.counter.tcp_info == None and self.sock.fileno() != -1:
+            self.counter.tcp_info = tcp_info(self.sock)
+        self.sock.close()
@@ -0,0 +1,1097 @@
+import unittest
+import collections
+import ftplib
+import pytest
+import time
+import posixpath
+import random
+import threading
+import os
+import ipaddress
+import signal
+import socket
+import warnings
+import multiprocessing
+
+from . import bench, get_share_path
+from .histogram import LatencyHistogram
+from .client import FtpClient, ClientPool, create_client
+from .tree import TreeBuilder
+from .payload import Payload, DigestSink
+from . import xferstats
+from . import active
+from . import replay
+from . import model
+from . import scenario
+from . import driver
+from . import agent
+
+class TestPipelineBenchmark(unittest.TestCase):
+    """Benchmark: pipelined control commands against serial round trips."""
+    client_class = FtpClient
+    control_cmds = ['noop', 'pwd', 'syst', 'type i', 'mode s', 'stru f']
+
+    def setUp(self):
+        super().setUp()
+        self.client = create_client(self.uconfig, self.client_class)
+
+    def tearDown(self):
+        self.client.close()
+        super().tearDown()
+
+    @pytest.mark.bench
+    def test_pipeline_speedup(self):
+        ncmds = self.uconfig.get('bench_pipeline_cmds', 1000)
+        cmds = [self.control_cmds[i % len(self.control_cmds)] for i in range(ncmds)]
+        # window 1 is a plain serial round trip per command
+        windows = [1, 8, 64, ncmds]
+        serial_codes = None
+        serial_time = None
+        for window in windows:
+            start = time.perf_counter()
+            resps = self.client.sendcmds(cmds, window=window)
+            elapsed = time.perf_counter() - start
+            codes = [resp[:3] for resp in resps]
+            if serial_codes == None:
+                serial_codes = codes
+                serial_time = elapsed
+            # a server that mishandles pipelined input drops, merges or
+            # reorders replies
+            assert codes == serial_codes, f'window {window}'
+            bench.report(self, f'pipeline_window_{window}',
+                         cmds=ncmds,
+                         seconds=elapsed,
+                         cmds_per_sec=ncmds / elapsed,
+                         speedup=serial_time / elapsed)
+
+class TestPathDepthBenchmark(unittest.TestCase):
+    """Benchmark: CWD, MKD, SIZE, MDTM and LIST latency against path depth."""
+    client_class = FtpClient
+
+    def setUp(self):
+        super().setUp()
+        self.client = create_client(self.uconfig, self.client_class)
+        self.tree = TreeBuilder(self.client, get_share_path(self.uconfig))
+
+    def tearDown(self):
+        self.tree.remove()
+        self.client.close()
+        super().tearDown()
+
+    def measure_mkd(self, path, repeat):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            self.client.mkd(path)
+            samples.append(time.perf_counter() - start)
+            self.client.rmd(path)
+        return samples
+
+    @pytest.mark.bench
+    def test_path_depth_latency(self):
+        depths = self.uconfig.get('bench_path_depths', [1, 5, 10, 20, 30, 40])
+        name_lens = self.uconfig.get('bench_path_name_lengths', [8, 32])
+        repeat = self.uconfig.get('bench_repeat', 20)
+        for name_len in name_lens:
+            levels = self.tree.deep(max(depths), name_len, files_per_level=1)
+            p50s = {}
+            for depth in depths:
+                path = levels[depth - 1]
+                file_path = posixpath.join(path, 'f0000')
+                # retrlines() leaves the session in ASCII mode
+                self.client.voidcmd('type i')
+                results = {
+                    'cwd': bench.measure(lambda: self.client.cwd(path), repeat),
+                    'mkd': self.measure_mkd(posixpath.join(path, 'mkd'), repeat),
+                    'size': bench.measure(lambda: self.client.size(file_path), repeat),
+                    'mdtm': bench.measure(lambda: self.client.sendcmd('mdtm ' + file_path), repeat),
+                    'list': bench.measure(lambda: self.client.retrlines('list ' + path, lambda line: None), repeat),
+                }
+                for op, samples in results.items():
+                    summary = bench.summarize(samples)
+                    p50s.setdefault(op, []).append(summary['p50'])
+                    bench.report(self, f'{op}_depth{depth}_name{name_len}',
+                                 depth=depth, path_len=len(path), **summary)
+            # a flat slope means path resolution doesn't grow with depth
+            for op, ys in p50s.items():
+                slope, intercept, r2 = bench.linear_fit(depths, ys)
+                bench.report(self, f'{op}_name{name_len}_fit',
+                             seconds_per_level=slope, intercept=intercept, r2=r2,
+                             deepest_vs_shallowest=ys[-1] / ys[0] if ys[0] else 0.0)
+            self.tree.remove()
+
+class TestMetadataStormBenchmark(unittest.TestCase):
+    """Benchmark: concurrent mix of SIZE, MDTM, MFMT, DELE, RNFR/RNTO and
+    SITE CHMOD over a seeded file population.
+    """
+    client_class = FtpClient
+    default_mix = {'size': 30, 'mdtm': 30, 'mfmt': 10, 'rename': 15, 'dele': 5, 'chmod': 10}
+    mfmt_timestamp = '20170921013410'
+
+    def setUp(self):
+        super().setUp()
+        self.client = create_client(self.uconfig, self.client_class)
+        self.sessions = self.uconfig.get('bench_sessions', 8)
+        self.pool = ClientPool(self.uconfig, self.sessions, self.client_class)
+        self.tree = TreeBuilder(self.client, get_share_path(self.uconfig), self.pool)
+
+    def tearDown(self):
+        self.tree.remove()
+        self.pool.close()
+        self.client.close()
+        super().tearDown()
+
+    def run_op(self, client, op, path):
+        if op == 'size':
+            client.size(path)
+        elif op == 'mdtm':
+            client.sendcmd('mdtm ' + path)
+        elif op == 'mfmt':
+            client.sendcmd(f'mfmt {self.mfmt_timestamp} {path}')
+        elif op == 'chmod':
+            client.sendcmd('site chmod 644 ' + path)
+        elif op == 'dele':
+            client.delete(path)
+        else:
+            raise ValueError(f'unknown metadata op {op}')
+
+    def run_session(self, client, index):
+        # every session owns a slice of the population, so errors come
+        # from the server and not from sessions racing each other
+        rng = random.Random(self.seed + index)
+        owned = self.tree.files[index::self.sessions]
+        current = {path: path for path in owned}
+        stats = bench.OpStats()
+        client.voidcmd('type i')
+        for _ in range(self.ops_per_session if owned else 0):
+            op = rng.choices(self.verbs, self.weights)[0]
+            path = rng.choice(owned)
+            start = time.perf_counter()
+            try:
+                if op == 'rename':
+                    target = path if current[path] != path else path + '~'
+                    client.rename(current[path], target)
+                    current[path] = target
+                else:
+                    self.run_op(client, op, current[path])
+            except ftplib.Error as e:
+                stats.record(op, 0.0, e)
+                continue
+            stats.record(op, time.perf_counter() - start)
+            if op == 'dele':
+                # keep the population stable
+                client.upload_fixed_size(current[path])
+        for path, name in current.items():
+            if name != path:
+                client.rename(name, path)
+        return stats
+
+    @pytest.mark.bench
+    def test_metadata_storm(self):
+        mix = self.uconfig.get('bench_meta_mix', self.default_mix)
+        self.verbs = list(mix)
+        self.weights = [mix[v] for v in self.verbs]
+        self.seed = self.uconfig.get('bench_seed', 0)
+        self.ops_per_session = self.uconfig.get('bench_meta_ops', 500)
+        dirs = self.uconfig.get('bench_meta_dirs', 10)
+        files_per_dir = self.uconfig.get('bench_meta_files_per_dir', 100)
+        self.tree.wide(dirs, files_per_dir=files_per_dir)
+        start = time.perf_counter()
+        results = self.pool.map(self.run_session, range(self.sessions))
+        elapsed = time.perf_counter() - start
+        stats = bench.OpStats()
+        for _, session_stats, err in results:
+            if err != None:
+                raise err
+            stats.merge(session_stats)
+        total = sum(len(samples) for samples in stats.latencies.values())
+        bench.report(self, 'metadata_storm', sessions=self.sessions, files=len(self.tree.files),
+                     seconds=elapsed, ops_per_sec=total / elapsed,
+                     errors=sum(stats.errors.values()))
+        for op, summary in stats.summary(elapsed).items():
+            bench.report(self, f'metadata_{op}', **summary)
+
+class TestRenameContentionBenchmark(unittest.TestCase):
+    """Benchmark: concurrent STOR/RETR while other sessions rename, delete
+    and re-create files in the same directories.
+    """
+    client_class = FtpClient
+
+    def setUp(self):
+        super().setUp()
+        self.client = create_client(self.uconfig, self.client_class)
+        self.xfer_sessions = self.uconfig.get('bench_transfer_sessions', 8)
+        self.churn_sessions = self.uconfig.get('bench_churn_sessions', 4)
+        self.pool = ClientPool(self.uconfig, self.xfer_sessions + self.churn_sessions, self.client_class)
+        self.tree = TreeBuilder(self.client, get_share_path(self.uconfig))
+
+    def tearDown(self):
+        self.tree.remove()
+        self.pool.close()
+        self.client.close()
+        super().tearDown()
+
+    def run_transfers(self, client, index):
+        # store then read back the same seeded payload, checking its digest
+        payload = Payload(self.xfer_size, seed=index)
+        path = posixpath.join(self.dirs[index % len(self.dirs)], f'xfer{index:04d}')
+        stats = bench.OpStats()
+        nbytes = 0
+        corrupted = 0
+        client.voidcmd('type i')
+        while time.perf_counter() < self.deadline:
+            op = 'stor'
+            try:
+                start = time.perf_counter()
+                client.storbinary('stor ' + path, payload.reader())
+                stats.record(op, time.perf_counter() - start)
+                op = 'retr'
+                sink = DigestSink()
+                start = time.perf_counter()
+                client.retrbinary('retr ' + path, sink.write)
+                stats.record(op, time.perf_counter() - start)
+            except ftplib.Error as e:
+                stats.record(op, 0.0, e)
+                continue
+            nbytes += payload.size + sink.size
+            if sink.size != payload.size or sink.hexdigest() != payload.digest():
+                corrupted += 1
+        return stats, nbytes, corrupted
+
+    def run_churn(self, client, index):
+        path = posixpath.join(self.dirs[index % len(self.dirs)], f'churn{index:04d}')
+        stats = bench.OpStats()
+        client.upload_fixed_size(path)
+        while time.perf_counter() < self.deadline:
+            for op, func in (('rename', lambda: client.rename(path, path + '~')),
+                             ('rename', lambda: client.rename(path + '~', path)),
+                             ('dele', lambda: client.delete(path)),
+                             ('create', lambda: client.upload_fixed_size(path))):
+                start = time.perf_counter()
+                try:
+                    func()
+                except ftplib.Error as e:
+                    stats.record(op, 0.0, e)
+                    continue
+                stats.record(op, time.perf_counter() - start)
+        return stats, 0, 0
+
+    def run_phase(self, churn):
+        workers = [(self.run_transfers, i) for i in range(self.xfer_sessions)]
+        if churn:
+            workers += [(self.run_churn, i) for i in range(self.churn_sessions)]
+        self.deadline = time.perf_counter() + self.duration
+        start = time.perf_counter()
+        results = self.pool.map(lambda client, w: w[0](client, w[1]), workers)
+        elapsed = time.perf_counter() - start
+        stats = bench.OpStats()
+        nbytes = 0
+        corrupted = 0
+        for _, result, err in results:
+            if err != None:
+                raise err
+            stats.merge(result[0])
+            nbytes += result[1]
+            corrupted += result[2]
+        return stats, nbytes / elapsed, corrupted, elapsed
+
+    @pytest.mark.bench
+    def test_rename_during_transfers(self):
+        self.duration = self.uconfig.get('bench_duration', 10)
+        self.xfer_size = self.uconfig.get('bench_transfer_size', 4 << 20)
+        self.dirs = self.tree.wide(self.uconfig.get('bench_contention_dirs', 4))
+        # the files the sessions create are removed with the tree
+        self.tree.files += [posixpath.join(self.dirs[i % len(self.dirs)], f'xfer{i:04d}')
+                            for i in range(self.xfer_sessions)]
+        self.tree.files += [posixpath.join(self.dirs[i % len(self.dirs)], f'churn{i:04d}')
+                            for i in range(self.churn_sessions)]
+        base_stats, base_rate, base_corrupted, _ = self.run_phase(churn=False)
+        stats, rate, corrupted, elapsed = self.run_phase(churn=True)
+        failed = sum(n for (op, _), n in stats.errors.items() if op in ('stor', 'retr'))
+        bench.report(self, 'contention',
+                     baseline_mb_per_sec=base_rate / 1e6,
+                     contended_mb_per_sec=rate / 1e6,
+                     throughput_drop=1 - rate / base_rate if base_rate else 0.0,
+                     failed_transfers=failed,
+                     corrupted_transfers=base_corrupted + corrupted)
+        for op, summary in stats.summary(elapsed).items():
+            bench.report(self, f'contention_{op}', **summary)
+        assert base_corrupted + corrupted == 0
+
+class TestAbortLatencyBenchmark(unittest.TestCase):
+    """Benchmark: time to acknowledge ABOR or a closed data connection
+    during large RETR and STOR transfers, under concurrent transfer load.
+    """
+    client_class = FtpClient
+
+    def setUp(self):
+        super().setUp()
+        self.client = create_client(self.uconfig, self.client_class)
+        self.levels = self.uconfig.get('bench_abort_concurrency', [1, 4, 16])
+        self.pool = ClientPool(self.uconfig, max(self.levels), self.client_class)
+        self.tree = TreeBuilder(self.client, get_share_path(self.uconfig))
+
+    def tearDown(self):
+        self.tree.remove()
+        self.pool.close()
+        self.client.close()
+        super().tearDown()
+
+    def run_load(self, client, stop):
+        client.voidcmd('type i')
+        while not stop.is_set():
+            client.retrbinary('retr ' + self.big_file, lambda data: None)
+
+    def cancel_once(self, client, direction, method, stats):
+        op = f'{direction}_{method}'
+        if direction == 'retr':
+            conn = client.transfercmd('retr ' + self.big_file)
+            received = 0
+            while received < self.cancel_after:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    break
+                received += len(chunk)
+        else:
+            conn = client.transfercmd('stor ' + self.cancel_file)
+            reader = self.payload.reader()
+            sent = 0
+            # stop while part of the payload is still to come, so the
+            # server sees a truncated upload
+            while sent < min(self.cancel_after, self.payload.size - 65536):
+                chunk = reader.read(65536)
+                conn.sendall(chunk)
+                sent += len(chunk)
+        try:
+            replies, timings = client.cancel_transfer(conn, method)
+        except ftplib.Error as e:
+            stats.record(op, 0.0, e)
+            return
+        except TimeoutError as e:
+            stats.record(op, 0.0, e)
+            # the replies are out of step now, start a new session
+            client.close()
+            client.connect(self.uconfig.get('server_host'), self.uconfig.get('server_port', 21))
+            client.login(self.uconfig.get('server_user'), self.uconfig.get('server_password'))
+            client.voidcmd('type i')
+            return
+        for phase, seconds in timings.items():
+            stats.record(f'{op}_{phase}', seconds)
+        self.replies[op]['/'.join(resp[:3] for resp in replies)] += 1
+
+    def run_cancels(self, client, stop):
+        stats = bench.OpStats()
+        client.voidcmd('type i')
+        try:
+            for _ in range(self.repeat):
+                for direction in ('retr', 'stor'):
+                    for method in ('abor', 'close'):
+                        self.cancel_once(client, direction, method, stats)
+        finally:
+            stop.set()
+        return stats
+
+    @pytest.mark.bench
+    def test_abort_latency(self):
+        self.repeat = self.uconfig.get('bench_repeat', 20)
+        self.cancel_after = self.uconfig.get('bench_abort_after', 1 << 20)
+        self.payload = Payload(self.uconfig.get('bench_abort_size', 64 << 20))
+        root = self.tree.make_root('-abort')
+        self.big_file = posixpath.join(root, 'big')
+        self.cancel_file = posixpath.join(root, 'cancelled')
+        self.client.storbinary('stor ' + self.big_file, self.payload.reader())
+        self.tree.files += [self.big_file, self.cancel_file]
+        for level in self.levels:
+            stop = threading.Event()
+            self.replies = collections.defaultdict(collections.Counter)
+            # one session cancels transfers, level - 1 sessions keep
+            # downloading the big file meanwhile
+            workers = [self.run_cancels] + [self.run_load] * (level - 1)
+            results = self.pool.map(lambda client, worker: worker(client, stop), workers)
+            for _, _, err in results:
+                if err != None:
+                    raise err
+            stats = results[0][1]
+            for op, summary in stats.summary(1.0).items():
+                summary.pop('ops_per_sec')
+                bench.report(self, f'abort_{op}_concurrency{level}', **summary)
+            for op, codes in self.replies.items():
+                bench.report(self, f'abort_{op}_replies_concurrency{level}', **codes)
+
+class TestTransferPhaseBenchmark(unittest.TestCase):
+    """Benchmark: STOR/RETR latency split into PASV, 150 reply, first
+    byte, data stream, close and final 226 reply.
+    """
+    client_class = FtpClient
+
+    def setUp(self):
+        super().setUp()
+        self.client = create_client(self.uconfig, self.client_class)
+        self.tree = TreeBuilder(self.client, get_share_path(self.uconfig))
+
+    def tearDown(self):
+        self.tree.remove()
+        self.client.close()
+        super().tearDown()
+
+    @pytest.mark.bench
+    def test_transfer_phases(self):
+        count = self.uconfig.get('bench_phase_transfers', 50)
+        payload = Payload(self.uconfig.get('bench_transfer_size', 4 << 20))
+        path = posixpath.join(self.tree.make_root('-phases'), 'file')
+        self.tree.files.append(path)
+        stor = xferstats.TransferRecorder()
+        retr = xferstats.TransferRecorder()
+        for _ in range(count):
+            with xferstats.recording(stor):
+                self.client.storbinary('stor ' + path, payload.reader())
+            with xferstats.recording(retr):
+                self.client.retrbinary('retr ' + path, lambda data: None)
+        # close_to_226 is the time the server spends finishing the file
+        # (flush, fsync, close) after the data connection is done
+        for name, recorder in (('stor', stor), ('retr', retr)):
+            for phase, summary in recorder.phase_summary().items():
+                bench.report(self, f'{name}_{phase}', **summary)
+
+class TestActiveModeBenchmark(unittest.TestCase):
+    """Benchmark: active (PORT/EPRT) against passive mode transfer
+    throughput and data connection setup latency at high concurrency.
+    """
+    client_class = FtpClient
+
+    def setUp(self):
+        super().setUp()
+        self.client = create_client(self.uconfig, self.client_class)
+        self.levels = self.uconfig.get('bench_active_concurrency', [1, 32, 256])
+        self.pool = ClientPool(self.uconfig, max(self.levels), self.client_class)
+        self.listeners = active.ListenerPool(self.client.sock.getsockname()[0], self.client.af,
+                                             self.uconfig.get('active_port_range', active.PORT_RANGE))
+        self.tree = TreeBuilder(self.client, get_share_path(self.uconfig))
+
+    def tearDown(self):
+        self.tree.remove()
+        self.pool.close()
+        self.listeners.close()
+        self.client.close()
+        super().tearDown()
+
+    def run_transfers(self, client, index, passive):
+        client.set_pasv(passive)
+        client.listeners = None if passive else self.listeners
+        stats = bench.OpStats()
+        nbytes = 0
+        path = posixpath.join(self.root, f'active{index:04d}')
+        try:
+            client.voidcmd('type i')
+            for i in range(self.repeat):
+                for op in ('stor', 'retr'):
+                    start = time.perf_counter()
+                    try:
+                        conn = client.transfercmd(f'{op} {path}')
+                        stats.record(f'{op}_setup', time.perf_counter() - start)
+                        with conn:
+                            if op == 'stor':
+                                for chunk in self.payload.chunks():
+                                    conn.sendall(chunk)
+                            else:
+                                while conn.recv(65536):
+                                    pass
+                        client.voidresp()
+                    except ftplib.Error as e:
+                        stats.record(op, 0.0, e)
+                        continue
+                    stats.record(op, time.perf_counter() - start)
+                    nbytes += self.payload.size
+        finally:
+            client.set_pasv(True)
+            client.listeners = None
+        return stats, nbytes
+
+    @pytest.mark.bench
+    def test_active_vs_passive(self):
+        self.repeat = self.uconfig.get('bench_repeat', 20)
+        self.payload = Payload(self.uconfig.get('bench_active_size', 1 << 20))
+        self.root = self.tree.make_root('-active')
+        self.tree.files += [posixpath.join(self.root, f'active{i:04d}') for i in range(max(self.levels))]
+        for level in self.levels:
+            for mode, passive in (('passive', True), ('active', False)):
+                start = time.perf_counter()
+                results = self.pool.map(lambda client, i: self.run_transfers(client, i, passive),
+                                        range(level))
+                elapsed = time.perf_counter() - start
+                stats = bench.OpStats()
+                nbytes = 0
+                for _, result, err in results:
+                    if err != None:
+                        raise err
+                    stats.merge(result[0])
+                    nbytes += result[1]
+                failed = sum(stats.errors.values())
+                bench.report(self, f'{mode}_concurrency{level}',
+                             mb_per_sec=nbytes / elapsed / 1e6,
+                             seconds=elapsed,
+                             failed_transfers=failed)
+                for op, summary in stats.summary(elapsed).items():
+                    bench.report(self, f'{mode}_{op}_concurrency{level}', **summary)
+                assert failed == 0
+        bench.report(self, 'active_listeners', **self.listeners.stats)
+
+class TestAddressFamilyBenchmark(unittest.TestCase):
+    """Benchmark: the same transfers and listings over IPv4 and IPv6,
+    through EPSV/EPRT on both, reported side by side.
+    """
+    client_class = FtpClient
+    list_ops = ('list', 'nlst', 'mlsd')
+
+    def setUp(self):
+        super().setUp()
+        self.client = create_client(self.uconfig, self.client_class)
+        self.tree = TreeBuilder(self.client, get_share_path(self.uconfig))
+
+    def tearDown(self):
+        self.tree.remove()
+        self.client.close()
+        super().tearDown()
+
+    def connect(self, host):
+        client = create_client(dict(self.uconfig, server_host=host), self.client_class)
+        client.extended = True
+        return client
+
+    def default_hosts(self):
+        # the families the configured server host resolves to, and both
+        # loopback addresses when the server is local
+        names = {socket.AF_INET: 'ipv4', socket.AF_INET6: 'ipv6'}
+        server_host = self.uconfig.get('server_host')
+        hosts = {}
+        try:
+            infos = socket.getaddrinfo(server_host, self.uconfig.get('server_port', 21), type=socket.SOCK_STREAM)
+        except OSError as e:
+            self.skipTest(f'cannot resolve server_host: {e}')
+        for family, _, _, _, addr in infos:
+            if family in names:
+                hosts.setdefault(names[family], addr[0])
+        if any(ipaddress.ip_address(addr.split('%')[0]).is_loopback for addr in hosts.values()):
+            hosts.setdefault('ipv4', '127.0.0.1')
+            hosts.setdefault('ipv6', '::1')
+        return hosts
+
+    def supported_list_ops(self):
+        # MLSD is optional (RFC 3659), only time it where FEAT offers it
+        # or a probe succeeds
+        ops = [op for op in self.list_ops if op != 'mlsd']
+        if 'mlsd' in self.list_ops:
+            try:
+                feat = self.client.sendcmd('feat')
+            except ftplib.error_perm:
+                feat = ''
+            if 'MLST' not in feat.upper():
+                try:
+                    self.client.retrlines('mlsd ' + self.list_dir, lambda line: None)
+                except ftplib.error_perm:
+                    return ops
+            ops.append('mlsd')
+        return ops
+
+    def run_family(self, client):
+        results = {}
+        client.voidcmd('type i')
+        for mode, passive in (('epsv', True), ('eprt', False)):
+            client.set_pasv(passive)
+            for op in ('stor', 'retr'):
+                recorder = xferstats.TransferRecorder()
+                with xferstats.recording(recorder):
+                    for _ in range(self.repeat):
+                        if op == 'stor':
+                            client.storbinary('stor ' + self.path, self.payload.reader())
+                        else:
+                            client.retrbinary('retr ' + self.path, lambda data: None)
+                phases = recorder.phase_summary()
+                seconds = sum(trace.end - trace.start for trace in recorder.traces)
+                results[f'{op}_{mode}'] = {
+                    'mb_per_sec': self.payload.size * self.repeat / seconds / 1e6,
+                    'setup_p50': bench.percentile([t.marks['reply_150'] - t.start
+                                                   for t in recorder.traces], 50),
+                    'p50': phases['total']['p50'],
+                    'p99': phases['total']['p99'],
+                }
+        client.set_pasv(True)
+        for op in self.ops:
+            samples = bench.measure(lambda: client.retrlines(f'{op} {self.list_dir}', lambda line: None),
+                                    self.repeat)
+            results[op] = bench.summarize(samples)
+        return results
+
+    @pytest.mark.bench
+    def test_address_families(self):
+        hosts = self.uconfig.get('bench_family_hosts') or self.default_hosts()
+        self.repeat = self.uconfig.get('bench_repeat', 20)
+        self.payload = Payload(self.uconfig.get('bench_transfer_size', 4 << 20))
+        root = self.tree.make_root('-family')
+        self.path = posixpath.join(root, 'file')
+        self.tree.files.append(self.path)
+        self.list_dir = self.tree.wide(1, files_per_dir=self.uconfig.get('bench_list_files', 1000))[0]
+        self.ops = self.supported_list_ops()
+        clients = {}
+        unreachable = []
+        try:
+            for family, host in hosts.items():
+                try:
+                    clients[family] = self.connect(host)
+                except OSError as e:
+                    unreachable.append(f'{family} {host}: {e}')
+            if len(clients) < 2:
+                self.skipTest(f'need two address families, reachable: {sorted(clients)}, '
+                              f'unreachable: {unreachable}')
+            results = {family: self.run_family(client) for family, client in clients.items()}
+        finally:
+            for client in clients.values():
+                client.close()
+        base = next(iter(results))
+        for key in results[base]:
+            side = {f'{family}_{metric}': value
+                    for family, result in results.items()
+                    for metric, value in result[key].items() if metric != 'count'}
+            for family, result in results.items():
+                if family != base and result[key]['p50'] and results[base][key]['p50']:
+                    side[f'{family}_p50_ratio'] = result[key]['p50'] / results[base][key]['p50']
+            bench.report(self, f'family_{key}', **side)
+
+class TestAppendBenchmark(unittest.TestCase):
+    """Benchmark: many sessions appending to one shared file or to one
+    file each, and a STOU storm into one directory.
+    """
+    client_class = FtpClient
+
+    def setUp(self):
+        super().setUp()
+        self.client = create_client(self.uconfig, self.client_class)
+        self.sessions = self.uconfig.get('bench_sessions', 8)
+        self.pool = ClientPool(self.uconfig, self.sessions, self.client_class)
+        self.tree = TreeBuilder(self.client, get_share_path(self.uconfig), self.pool)
+
+    def tearDown(self):
+        self.tree.remove()
+        self.pool.close()
+        self.client.close()
+        super().tearDown()
+
+    def run_appends(self, client, path, index):
+        record = Payload(self.record_size, seed=index)
+        stats = bench.OpStats()
+        for _ in range(self.count):
+            start = time.perf_counter()
+            try:
+                client.storbinary('appe ' + path, record.reader())
+            except ftplib.Error as e:
+                stats.record('appe', 0.0, e)
+                continue
+            stats.record('appe', time.perf_counter() - start)
+        return stats
+
+    def count_torn_records(self, path, digests):
+        # a record that doesn't hash like any session's record was
+        # interleaved with another session's append
+        torn = 0
+        buf = bytearray()
+
+        def write(data):
+            nonlocal torn
+            buf.extend(data)
+            while len(buf) >= self.record_size:
+                sink = DigestSink()
+                sink.write(buf[:self.record_size])
+                del buf[:self.record_size]
+                if sink.hexdigest() not in digests:
+                    torn += 1
+
+        self.client.retrbinary('retr ' + path, write)
+        return torn + (1 if buf else 0)
+
+    @pytest.mark.bench
+    def test_concurrent_appe(self):
+        self.count = self.uconfig.get('bench_append_count', 50)
+        self.record_size = self.uconfig.get('bench_append_size', 64 << 10)
+        root = self.tree.make_root('-appe')
+        shared = posixpath.join(root, 'shared')
+        distinct = [posixpath.join(root, f'appe{i:04d}') for i in range(self.sessions)]
+        self.tree.make_files([shared] + distinct)
+        digests = set(Payload(self.record_size, seed=i).digest() for i in range(self.sessions))
+        for mode in ('distinct', 'shared'):
+            paths = [shared] * self.sessions if mode == 'shared' else distinct
+            start = time.perf_counter()
+            results = self.pool.map(lambda client, i: self.run_appends(client, paths[i], i),
+                                    range(self.sessions))
+            elapsed = time.perf_counter() - start
+            stats = bench.OpStats()
+            for _, session_stats, err in results:
+                if err != None:
+                    raise err
+                stats.merge(session_stats)
+            appended = len(stats.latencies['appe'])
+            self.client.voidcmd('type i')
+            if mode == 'shared':
+                size_mismatches = int(self.client.size(shared) != appended * self.record_size)
+                torn = self.count_torn_records(shared, digests)
+            else:
+                sizes = [self.client.size(p) for p in distinct]
+                size_mismatches = sum(1 for i, size in enumerate(sizes)
+                                      if size != len(results[i][1].latencies['appe']) * self.record_size)
+                torn = 0
+            bench.report(self, f'appe_{mode}', sessions=self.sessions, appends=appended,
+                         mb_per_sec=appended * self.record_size / elapsed / 1e6,
+                         seconds=elapsed, errors=sum(stats.errors.values()),
+                         size_mismatches=size_mismatches, torn_records=torn)
+            bench.report(self, f'appe_{mode}_latency', **stats.summary(elapsed)['appe'])
+            assert size_mismatches == 0
+
+    def run_stou(self, client, index):
+        payload = Payload(self.stou_size, seed=index)
+        stats = bench.OpStats()
+        names = []
+        client.cwd(self.root)
+        for _ in range(self.count):
+            start = time.perf_counter()
+            try:
+                names.append(client.stor_unique(payload.reader()))
+            except ftplib.Error as e:
+                stats.record('stou', 0.0, e)
+                continue
+            stats.record('stou', time.perf_counter() - start)
+        return stats, names
+
+    @pytest.mark.bench
+    def test_stou_storm(self):
+        self.count = self.uconfig.get('bench_stou_count', 100)
+        self.stou_size = self.uconfig.get('bench_stou_size', 4096)
+        self.root = self.tree.make_root('-stou')
+        self.client.cwd(self.root)
+        try:
+            probe = self.client.stor_unique(Payload(0).reader())
+        except ftplib.error_perm as e:
+            self.skipTest(f'STOU not supported: {e}')
+        names = [probe]
+        start = time.perf_counter()
+        results = self.pool.map(self.run_stou, range(self.sessions))
+        elapsed = time.perf_counter() - start
+        stats = bench.OpStats()
+        for _, result, err in results:
+            if err != None:
+                raise err
+            stats.merge(result[0])
+            names.extend(result[1])
+        known = [name for name in names if name != None]
+        self.tree.files += [posixpath.join(self.root, name) for name in set(known)]
+        listed = self.client.nlst(self.root)
+        self.client.voidcmd('type i')
+        size_mismatches = 0
+        for resp in self.client.sendcmds(['size ' + posixpath.join(self.root, name)
+                                          for name in set(known) if name != probe]):
+            if resp[:3] != '213' or int(resp[3:].strip()) != self.stou_size:
+                size_mismatches += 1
+        stored = len(stats.latencies['stou'])
+        bench.report(self, 'stou_storm', sessions=self.sessions, files=stored,
+                     files_per_sec=stored / elapsed, seconds=elapsed,
+                     errors=sum(stats.errors.values()),
+                     duplicate_names=len(known) - len(set(known)),
+                     unnamed=len(names) - len(known),
+                     listed=len(listed), size_mismatches=size_mismatches)
+        bench.report(self, 'stou_latency', **stats.summary(elapsed)['stou'])
+        assert len(known) == len(set(known))
+        assert size_mismatches == 0
+
+class TestReplayBenchmark(unittest.TestCase):
+    """Benchmark: replay the sessions of a recorded xferlog or vsftpd log
+    and compare the replayed latencies with the recorded ones.
+    """
+    client_class = FtpClient
+
+    def setUp(self):
+        super().setUp()
+        self.client = create_client(self.uconfig, self.client_class)
+        self.tree = TreeBuilder(self.client, get_share_path(self.uconfig))
+
+    def tearDown(self):
+        self.tree.remove()
+        self.client.close()
+        super().tearDown()
+
+    @pytest.mark.bench
+    def test_replay(self):
+        log_path = self.uconfig.get('replay_log')
+        if log_path == None:
+            self.skipTest('replay_log is not configured')
+        entries = replay.parse_log(log_path, self.uconfig.get('replay_session_gap', 60))
+        replayer = replay.Replayer(self.uconfig, entries, self.tree.make_root('-replay'),
+                                   self.uconfig.get('replay_speedup', 1.0),
+                                   self.uconfig.get('replay_max_sessions', 64),
+                                   self.client_class)
+        self.tree.files += list(replayer.paths.values())
+        self.tree.dirs += list(replayer.dirs.values())
+        replayer.seed_files(self.uconfig.get('bench_sessions', 8))
+        result = replayer.run()
+        bench.report(self, 'replay', entries=len(result.entries), sessions=result.sessions,
+                     speedup=replayer.speedup, seconds=result.elapsed,
+                     errors=sum(result.stats.errors.values()))
+        bench.report(self, 'replay_schedule_lag', **result.lag.summary())
+        for op, comparison in result.comparison().items():
+            bench.report(self, f'replay_{op}', **comparison)
+
+class TestWorkloadModelBenchmark(unittest.TestCase):
+    """Benchmark: synthetic load drawn from a workload model fitted from a
+    transfer log, scaled to a multiple of the recorded session rate.
+    """
+    client_class = FtpClient
+
+    def setUp(self):
+        super().setUp()
+        self.client = create_client(self.uconfig, self.client_class)
+        self.tree = TreeBuilder(self.client, get_share_path(self.uconfig))
+
+    def tearDown(self):
+        self.tree.remove()
+        self.client.close()
+        super().tearDown()
+
+    def get_model(self):
+        path = self.uconfig.get('workload_model')
+        if path != None:
+            return model.WorkloadModel.load(path)
+        log_path = self.uconfig.get('replay_log')
+        if log_path == None:
+            self.skipTest('neither workload_model nor replay_log is configured')
+        fitted = model.WorkloadModel.fit(replay.parse_log(log_path, self.uconfig.get('replay_session_gap', 60)))
+        if self.uconfig.get('workload_model_out') != None:
+            fitted.save(self.uconfig.get('workload_model_out'))
+        return fitted
+
+    @pytest.mark.bench
+    def test_model_load(self):
+        workload = self.get_model()
+        load = model.SyntheticLoad(self.uconfig, workload, self.tree.make_root('-model'),
+                                   self.uconfig.get('model_scale', 1.0),
+                                   self.uconfig.get('bench_duration', 10),
+                                   self.uconfig.get('bench_seed', 0),
+                                   self.uconfig.get('model_max_sessions', 64),
+                                   self.client_class)
+        load.seed_files(self.uconfig.get('bench_sessions', 8))
+        stats, start_lag, elapsed, sessions = load.run()
+        self.tree.files += list(load.seeded.values())
+        self.tree.files += [p for p in load.created if posixpath.basename(p)[0] == 'f']
+        self.tree.dirs += [p for p in load.created if posixpath.basename(p)[0] == 'd']
+        total = sum(len(samples) for samples in stats.latencies.values())
+        bench.report(self, 'model_load', scale=load.scale, sessions=sessions,
+                     target_sessions_per_sec=workload.session_rate * load.scale,
+                     offered_sessions_per_sec=sessions / load.duration, ops_per_sec=total / elapsed,
+                     seconds=elapsed, errors=sum(stats.errors.values()))
+        bench.report(self, 'model_session_start_lag', **start_lag.summary())
+        for op, summary in stats.summary(elapsed).items():
+            bench.report(self, f'model_{op}', **summary)
+
+class TestScenarioBenchmark(unittest.TestCase):
+    """Benchmark: run the YAML/JSON scenario files listed in `scenarios`."""
+    client_class = FtpClient
+    default_scenarios = [os.path.join(os.path.dirname(__file__), 'scenarios', name)
+                         for name in ('mixed.yaml', 'open_loop.yaml')]
+
+    def setUp(self):
+        super().setUp()
+        self.client = create_client(self.uconfig, self.client_class)
+        self.tree = TreeBuilder(self.client, get_share_path(self.uconfig))
+
+    def tearDown(self):
+        self.tree.remove()
+        self.client.close()
+        super().tearDown()
+
+    @pytest.mark.bench
+    def test_scenarios(self):
+        for path in self.uconfig.get('scenarios', self.default_scenarios):
+            plan = scenario.load_scenario(path)
+            runner = scenario.ScenarioRunner(self.uconfig, plan, self.tree.make_root('-' + plan.name),
+                                             self.client_class)
+            try:
+                runner.prepare(self.client, self.uconfig.get('bench_sessions', 8))
+                results, durations = runner.run()
+            finally:
+                self.tree.files += runner.created
+                self.tree.dirs += runner.dirs
+            if plan.mode == 'open':
+                # how far behind its schedule the client finished
+                done = sum(len(samples) for stats in results.values() for samples in stats.latencies.values())
+                bench.report(self, f'scenario_{plan.name}', planned_seconds=plan.duration(),
+                             seconds=runner.elapsed, behind=runner.elapsed - plan.duration(),
+                             target_ops_per_sec=len(runner.plan) / plan.duration(),
+                             achieved_ops_per_sec=done / runner.elapsed)
+            for phase, stats in results.items():
+                total = sum(len(samples) for samples in stats.latencies.values())
+                extra = {}
+                if plan.mode == 'open':
+                    planned = sum(1 for _, name in runner.plan if name == phase)
+                    extra = dict(target_ops_per_sec=planned / durations[phase])
+                bench.report(self, f'scenario_{plan.name}_{phase}', seconds=durations[phase],
+                             ops_per_sec=total / durations[phase], errors=sum(stats.errors.values()),
+                             **extra)
+                for op, summary in stats.summary(durations[phase]).items():
+                    bench.report(self, f'scenario_{plan.name}_{phase}_{op}', **summary)
+                if plan.mode == 'open':
+                    bench.report(self, f'scenario_{plan.name}_{phase}_schedule_lag',
+                                 **runner.lag.get(phase, LatencyHistogram()).summary())
+                    for op, summary in runner.service.get(phase, bench.OpStats()).summary(durations[phase]).items():
+                        bench.report(self, f'scenario_{plan.name}_{phase}_{op}_service', **summary)
+
+class TestLoadDriverBenchmark(unittest.TestCase):
+    """Benchmark: a scenario sharded over `driver_workers` processes,
+    reported per worker and merged, with a warning for workers that used
+    most of their CPU and so were likely the bottleneck themselves.
+    """
+    client_class = FtpClient
+    default_scenario = os.path.join(os.path.dirname(__file__), 'scenarios', 'mixed.yaml')
+
+    def setUp(self):
+        super().setUp()
+        self.client = create_client(self.uconfig, self.client_class)
+        self.tree = TreeBuilder(self.client, get_share_path(self.uconfig))
+
+    def tearDown(self):
+        self.tree.remove()
+        self.client.close()
+        super().tearDown()
+
+    @pytest.mark.bench
+    def test_load_driver(self):
+        plan = scenario.load_scenario(self.uconfig.get('driver_scenario', self.default_scenario))
+        load = driver.LoadDriver(self.uconfig, plan, self.tree.make_root('-driver'),
+                                 self.uconfig.get('driver_workers', 4),
+                                 self.uconfig.get('driver_affinity', False),
+                                 client_class=self.client_class)
+        self.tree.make_dirs(load.roots)
+        results = load.run()
+        for result in results:
+            self.tree.files += result.created
+            self.tree.dirs += result.dirs
+        failed = [result.error for result in results if result.error != None]
+        assert not failed, failed[0]
+        threshold = self.uconfig.get('driver_cpu_bound', driver.CPU_BOUND)
+        for result in results:
+            bench.report(self, f'driver_worker_{result.worker}', pid=result.pid,
+                         cpu=-1 if result.cpu == None else result.cpu, ops=result.ops(),
+                         ops_per_sec=result.ops() / result.elapsed, errors=result.errors(),
+                         seconds=result.elapsed, cpu_seconds=result.cpu_seconds, cpu_pct=result.cpu_pct())
+        bound = [result.worker for result in results if result.cpu_bound(threshold)]
+        if bound:
+            warnings.warn(f'load driver workers {bound} used over {threshold:.0%} of a CPU, the results '
+                          f'may measure the client rather than the server; add workers or machines')
+        stats, service, lag = driver.aggregate(results)
+        elapsed = max(result.elapsed for result in results)
+        total = sum(len(hist) for phase_stats in stats.values() for hist in phase_stats.latencies.values())
+        bench.report(self, f'driver_{plan.name}', workers=load.workers, seconds=elapsed,
+                     ops_per_sec=total / elapsed, cpu_bound_workers=len(bound),
+                     cpu_pct=100.0 * sum(result.cpu_seconds for result in results) / elapsed)
+        durations = {phase.name: phase.duration for phase in plan.phases}
+        for phase, phase_stats in stats.items():
+            for op, summary in phase_stats.summary(durations[phase]).items():
+                bench.report(self, f'driver_{plan.name}_{phase}_{op}', **summary)
+            if plan.mode == 'open':
+                bench.report(self, f'driver_{plan.name}_{phase}_schedule_lag', **lag[phase].summary())
+                for op, summary in service.get(phase, bench.OpStats()).summary(durations[phase]).items():
+                    bench.report(self, f'driver_{plan.name}_{phase}_{op}_service', **summary)
+
+class TestAgentBenchmark(unittest.TestCase):
+    """Benchmark: a scenario driven by `agents` load agents started on this
+    host, through a coordinator, merged like the load driver's workers.
+    """
+    client_class = FtpClient
+    default_scenario = os.path.join(os.path.dirname(__file__), 'scenarios', 'mixed.yaml')
+
+    def setUp(self):
+        super().setUp()
+        self.client = create_client(self.uconfig, self.client_class)
+        self.tree = TreeBuilder(self.client, get_share_path(self.uconfig))
+        self.procs = []
+
+    def tearDown(self):
+        for proc in self.procs:
+            proc.join(5)
+            if proc.is_alive():
+                proc.terminate()
+        self.tree.remove()
+        self.client.close()
+        super().tearDown()
+
+    @pytest.mark.bench
+    def test_agents(self):
+        plan = scenario.load_scenario(self.uconfig.get('agent_scenario', self.default_scenario))
+        nagents = self.uconfig.get('agents', 3)
+        with agent.Coordinator(self.uconfig, plan, self.tree.make_root('-agents'), nagents) as coordinator:
+            self.tree.make_dirs(coordinator.roots)
+            ctx = multiprocessing.get_context('spawn')
+            for i in range(nagents):
+                proc = ctx.Process(target=agent.run_agent, args=(coordinator.address,), daemon=True)
+                proc.start()
+                self.procs.append(proc)
+            coordinator.accept(60)
+            results = coordinator.run()
+            streamed = coordinator.live
+            updates = coordinator.updates
+        for result in results:
+            self.tree.files += result.created
+            self.tree.dirs += result.dirs
+        failed = [result.error for result in results if result.error != None]
+        assert not failed, failed[0]
+        for result in results:
+            # the progress messages add up to the final result
+            assert updates.get(result.worker, 0) >= 1, f'agent {result.worker} streamed no progress'
+            assert sum(len(hist) for stats in streamed[result.worker].values()
+                       for hist in stats.latencies.values()) == result.ops()
+            bench.report(self, f'agent_{result.worker}', pid=result.pid, ops=result.ops(),
+                         progress_messages=updates.get(result.worker, 0),
+                         ops_per_sec=result.ops() / result.elapsed, errors=result.errors(),
+                         seconds=result.elapsed, cpu_pct=result.cpu_pct())
+        stats, service, lag = driver.aggregate(results)
+        elapsed = max(result.elapsed for result in results)
+        total = sum(result.ops() for result in results)
+        bench.report(self, f'agents_{plan.name}', agents=nagents, seconds=elapsed, ops_per_sec=total / elapsed)
+        durations = {phase.name: phase.duration for phase in plan.phases}
+        for phase, phase_stats in stats.items():
+            for op, summary in phase_stats.summary(durations[phase]).items():
+                bench.report(self, f'agents_{plan.name}_{phase}_{op}', **summary)
+            if plan.mode == 'open':
+                bench.report(self, f'agents_{plan.name}_{phase}_schedule_lag', **lag[phase].summary())
+
+    def kill_after_progress(self, coordinator, proc, stop):
+        while not stop.wait(0.05):
+            if coordinator.updates.get(0, 0) >= 1:
+                os.kill(proc.pid, signal.SIGKILL)
+                return
+
+    @pytest.mark.bench
+    def test_agent_killed(self):
+        plan = scenario.load_scenario(self.uconfig.get('agent_scenario', self.default_scenario))
+        with agent.Coordinator(self.uconfig, plan, self.tree.make_root('-agents'), 2,
+                               progress_interval=0.2) as coordinator:
+            self.tree.make_dirs(coordinator.roots)
+            ctx = multiprocessing.get_context('spawn')
+            for i in range(2):
+                proc = ctx.Process(target=agent.run_agent, args=(coordinator.address,), daemon=True)
+                proc.start()
+                self.procs.append(proc)
+            coordinator.accept(60)
+            # agent 0 is the first to say hello, not necessarily the first process
+            victim = next(proc for proc in self.procs if proc.pid == coordinator.hellos[0]['pid'])
+            stop = threading.Event()
+            killer = threading.Thread(target=self.kill_after_progress, args=(coordinator, victim, stop))
+            killer.start()
+            try:
+                results = coordinator.run()
+            finally:
+                stop.set()
+                killer.join()
+        # the killed agent's files are left to the session end GC
+        self.tree.files += results[1].created
+        self.tree.dirs += results[1].dirs
+        assert results[0].error != None and 'went away' in results[0].error
+        assert results[0].ops() > 0, 'the killed agent kept none of its streamed results'
+        assert results[1].error == None, results[1].error
+        bench.report(self, 'agent_killed', streamed_ops=results[0].ops(),
+                     progress_messages=coordinator.updates[0], survivor_ops=results[1].ops())
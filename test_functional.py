@@ -11,13 +11,16 @@ import socket
 
 from . import GLOBAL_TIMEOUT, BUFSIZE, INTERRUPTED_TRANSF_SIZE, TEST_PREFIX
 from . import get_tmpfilename
-from . import touch_filename
+from .client import FtpClient
+from .payload import Payload, DigestSink
+from .cleanup import is_test_artifact
+from .tree import TreeBuilder
 
 class TestFtpFsOperations(unittest.TestCase):
     """Test: PWD, CWD, CDUP, SIZE, RNFR, RNTO, DELE, MKD, RMD, MDTM,
     STAT, MFMT.
     """
-    client_class = ftplib.FTP
+    client_class = FtpClient
 
     def create_client(self):
         server_host = self.uconfig.get('server_host')
@@ -36,15 +39,33 @@ class TestFtpFsOperations(unittest.TestCase):
         self.client = self.create_client()
         self.work_dir = self.uconfig.get('work_dir')
         self.share_name = self.uconfig.get('share_name')
-        self.temp_dir_path = self.make_tmp_dir()
-        self.temp_file_path = self.make_tmp_file()
+        self._temp_dir_path = None
+        self._temp_file_path = None
 
     def tearDown(self):
-        self.clean_tmp_dir(self.temp_dir_path)
-        self.clean_tmp_file(self.temp_file_path)
+        if self._temp_dir_path != None:
+            self.clean_tmp_dir(self._temp_dir_path)
+        if self._temp_file_path != None:
+            self.clean_tmp_file(self._temp_file_path)
         self.client.close()
         super().tearDown()
 
+    @property
+    def temp_dir_path(self):
+        # created on first access, so tests that never use it skip
+        # the MKD/RMD round trips
+        if self._temp_dir_path == None:
+            self._temp_dir_path = self.make_tmp_dir()
+        return self._temp_dir_path
+
+    @property
+    def temp_file_path(self):
+        # created on first access, so tests that never use it skip
+        # the STOR/DELE round trips and the data connection
+        if self._temp_file_path == None:
+            self._temp_file_path = self.make_tmp_file()
+        return self._temp_file_path
+
     def generate_valid_path(self, *args):
         p = os.path.normpath('/'.join(args))
         if p.startswith('//'):
@@ -116,6 +137,17 @@ class TestFtpFsOperations(unittest.TestCase):
         self.client.cwd(long_path)
         assert os.path.normpath(self.client.pwd()) == '/'
 
+    @pytest.mark.base
+    @pytest.mark.cwd
+    def test_cwd_deeppath(self):
+        tree = TreeBuilder(self.client, self.get_share_path())
+        try:
+            levels = tree.deep(32, name_len=32)
+            self.client.cwd(levels[-1])
+            assert os.path.normpath(self.client.pwd()) == levels[-1]
+        finally:
+            tree.remove()
+
     @pytest.mark.base
     @pytest.mark.cwd
     def test_cwd_tilde_ok(self):
@@ -166,6 +198,8 @@ class TestFtpFsOperations(unittest.TestCase):
         return subpath
 
     def clean_tmp_dir(self, subpath):
+        if self.defer_cleanup and is_test_artifact(subpath):
+            return
         try:
             self.client.rmd(subpath)
         except Exception as e:
@@ -375,13 +409,12 @@ class TestFtpFsOperations(unittest.TestCase):
     def make_tmp_file(self):
         tmpfile = get_tmpfilename('-{}'.format(self._testMethodName))
         tmp_path = self.get_tmp_path(tmpfile)
-        touch_filename(tmpfile)
-        with open(tmpfile, 'rb') as f:
-            self.client.storbinary('stor ' + tmp_path, f)
-        os.remove(tmpfile)
+        self.client.upload_fixed_size(tmp_path)
         return tmp_path
 
     def clean_tmp_file(self, subpath):
+        if self.defer_cleanup and is_test_artifact(subpath):
+            return
         try:
             self.client.delete(subpath)
         except Exception as e:
@@ -504,14 +537,10 @@ class TestFtpFsOperations(unittest.TestCase):
     @pytest.mark.base
     @pytest.mark.rename
     def test_rnfr_rnto_with_xfer(self):
-        data = b'abcde12345' * 100000
-        dummy_sendfile = io.BytesIO()
-        dummy_sendfile.write(data)
-        dummy_sendfile.seek(0)
-        #dummy_recvfile = io.BytesIO()
+        payload = Payload(1000000)
         temp_file_path = self.get_tmp_path()
         temp_file_path2 = self.get_tmp_path()
-        self.client.storbinary("stor " + temp_file_path, dummy_sendfile)
+        self.client.storbinary("stor " + temp_file_path, payload.reader())
         do_rename = False
         def do_rename_function():
             client2 = self.create_client()
@@ -539,7 +568,6 @@ class TestFtpFsOperations(unittest.TestCase):
             if not re.search("350", str(e)):
                 pytest.fail(str(e))
         t1.join()
-        dummy_sendfile.close()
         self.clean_tmp_file(temp_file_path)
         self.clean_tmp_file(temp_file_path2)
 
@@ -687,7 +715,7 @@ class TestFtpFsOperations(unittest.TestCase):
 class TestFtpStoreData(unittest.TestCase):
     """Test STOR, STOU, APPE, REST, TYPE."""
 
-    client_class = ftplib.FTP
+    client_class = FtpClient
 
     def make_client(self):
         server_host = self.uconfig.get('server_host')
@@ -711,7 +739,7 @@ class TestFtpStoreData(unittest.TestCase):
 
     def tearDown(self):
         try:
-            if self.temp_file_path != None:
+            if self.temp_file_path != None and not (self.defer_cleanup and is_test_artifact(self.temp_file_path)):
                 self.client.delete(self.temp_file_path)
         except Exception as e:
             pass
@@ -729,18 +757,15 @@ class TestFtpStoreData(unittest.TestCase):
 
     @pytest.mark.base
     def test_stor(self):
-        data = b'abcde12345' * 100000
-        self.dummy_sendfile.write(data)
-        self.dummy_sendfile.seek(0)
+        payload = Payload(1000000)
+        recvfile = DigestSink()
         self.temp_file_path = self.get_tmp_file_path()
-        self.client.storbinary('stor ' + self.temp_file_path, self.dummy_sendfile)
+        self.client.storbinary('stor ' + self.temp_file_path, payload.reader())
         self.client.retrbinary(
-            'retr ' + self.temp_file_path, self.dummy_recvfile.write
+            'retr ' + self.temp_file_path, recvfile.write
         )
-        self.dummy_recvfile.seek(0)
-        datafile = self.dummy_recvfile.read()
-        assert len(data) == len(datafile)
-        assert hash(data) == hash(datafile)
+        assert payload.size == recvfile.size
+        assert payload.digest() == recvfile.hexdigest()
 
     @pytest.mark.base
     def test_stor_active(self):
@@ -852,24 +877,23 @@ class TestFtpStoreData(unittest.TestCase):
     '''
     @pytest.mark.base
     def test_appe(self):
-        data1 = b'abcde12345' * 100000
-        self.dummy_sendfile.write(data1)
-        self.dummy_sendfile.seek(0)
+        payload1 = Payload(1000000, seed=1)
         self.temp_file_path = self.get_tmp_file_path()
-        self.client.storbinary('stor ' + self.temp_file_path, self.dummy_sendfile)
+        self.client.storbinary('stor ' + self.temp_file_path, payload1.reader())
 
-        data2 = b'fghil67890' * 100000
-        self.dummy_sendfile.write(data2)
-        self.dummy_sendfile.seek(len(data1))
-        self.client.storbinary('appe ' + self.temp_file_path, self.dummy_sendfile)
+        payload2 = Payload(1000000, seed=2)
+        self.client.storbinary('appe ' + self.temp_file_path, payload2.reader())
 
+        recvfile = DigestSink()
         self.client.retrbinary(
-            "retr " + self.temp_file_path, self.dummy_recvfile.write
+            "retr " + self.temp_file_path, recvfile.write
         )
-        self.dummy_recvfile.seek(0)
-        datafile = self.dummy_recvfile.read()
-        assert len(data1 + data2) == len(datafile)
-        assert hash(data1 + data2) == hash(datafile)
+        expected = DigestSink()
+        for payload in (payload1, payload2):
+            for chunk in payload.chunks():
+                expected.write(chunk)
+        assert expected.size == recvfile.size
+        assert expected.hexdigest() == recvfile.hexdigest()
 
     @pytest.mark.base
     def test_appe_rest(self):
@@ -882,9 +906,8 @@ class TestFtpStoreData(unittest.TestCase):
     @pytest.mark.base
     def test_rest_on_stor(self):
         # Test STOR preceded by REST.
-        data = b'abcde12345' * 100000
-        self.dummy_sendfile.write(data)
-        self.dummy_sendfile.seek(0)
+        payload = Payload(1000000)
+        sendfile = payload.reader()
 
         self.temp_file_path = self.get_tmp_file_path()
 
@@ -894,7 +917,7 @@ class TestFtpStoreData(unittest.TestCase):
         ) as conn:
             bytes_sent = 0
             while True:
-                chunk = self.dummy_sendfile.read(BUFSIZE)
+                chunk = sendfile.read(BUFSIZE)
                 conn.sendall(chunk)
                 bytes_sent += len(chunk)
                 # stop transfer while it isn't finished yet
@@ -912,18 +935,14 @@ class TestFtpStoreData(unittest.TestCase):
         with pytest.raises(ftplib.error_temp, match="425 Use PORT or PASV first"):
             self.client.sendcmd('stor ' + self.temp_file_path)
         self.client.sendcmd(f'rest {bytes_sent}')
-        self.client.storbinary('stor ' + self.temp_file_path, self.dummy_sendfile)
+        self.client.storbinary('stor ' + self.temp_file_path, sendfile)
 
+        recvfile = DigestSink()
         self.client.retrbinary(
-            'retr ' + self.temp_file_path, self.dummy_recvfile.write
+            'retr ' + self.temp_file_path, recvfile.write
         )
-        self.dummy_sendfile.seek(0)
-        self.dummy_recvfile.seek(0)
-
-        data_sendfile = self.dummy_sendfile.read()
-        data_recvfile = self.dummy_recvfile.read()
-        assert len(data_sendfile) == len(data_recvfile)
-        assert len(data_sendfile) == len(data_recvfile)
+        assert payload.size == recvfile.size
+        assert payload.digest() == recvfile.hexdigest()
 
     '''
     def test_failing_rest_on_stor(self):
@@ -981,7 +1000,7 @@ class TestFtpStoreData(unittest.TestCase):
 class TestFtpRetrieveData(unittest.TestCase):
     """Test RETR, REST, TYPE."""
 
-    client_class = ftplib.FTP
+    client_class = FtpClient
 
     def retrieve_ascii(self, cmd, callback, blocksize=8192, rest=None):
         """Like retrbinary but uses TYPE A instead."""
@@ -1014,7 +1033,7 @@ class TestFtpRetrieveData(unittest.TestCase):
 
     def tearDown(self):
         try:
-            if self.temp_file_path != None:
+            if self.temp_file_path != None and not (self.defer_cleanup and is_test_artifact(self.temp_file_path)):
                 self.client.delete(self.temp_file_path)
         except Exception as e:
             pass
@@ -1032,16 +1051,13 @@ class TestFtpRetrieveData(unittest.TestCase):
 
     @pytest.mark.base
     def test_retr(self):
-        data = b'abcde12345' * 100000
-        self.dummy_sendfile.write(data)
-        self.dummy_sendfile.seek(0)
+        payload = Payload(1000000)
+        recvfile = DigestSink()
         self.temp_file_path = self.get_tmp_file_path()
-        self.client.storbinary('stor ' + self.temp_file_path, self.dummy_sendfile)
-        self.client.retrbinary("retr " + self.temp_file_path, self.dummy_recvfile.write)
-        self.dummy_recvfile.seek(0)
-        datafile = self.dummy_recvfile.read()
-        assert len(data) == len(datafile)
-        assert hash(data) == hash(datafile)
+        self.client.storbinary('stor ' + self.temp_file_path, payload.reader())
+        self.client.retrbinary("retr " + self.temp_file_path, recvfile.write)
+        assert payload.size == recvfile.size
+        assert payload.digest() == recvfile.hexdigest()
 
         # attempt to retrieve a file which doesn't exist
         bogus = self.get_tmp_file_path()
@@ -1079,11 +1095,10 @@ class TestFtpRetrieveData(unittest.TestCase):
 
     @pytest.mark.base
     def test_restore_on_retr(self):
-        data = b'abcde12345' * 1000000
-        self.dummy_sendfile.write(data)
-        self.dummy_sendfile.seek(0)
+        payload = Payload(10000000)
+        recvfile = DigestSink()
         self.temp_file_path = self.get_tmp_file_path()
-        self.client.storbinary('stor ' + self.temp_file_path, self.dummy_sendfile)
+        self.client.storbinary('stor ' + self.temp_file_path, payload.reader())
 
         received_bytes = 0
         self.client.voidcmd('TYPE I')
@@ -1095,7 +1110,7 @@ class TestFtpRetrieveData(unittest.TestCase):
                 chunk = conn.recv(BUFSIZE)
                 if not chunk:
                     break
-                self.dummy_recvfile.write(chunk)
+                recvfile.write(chunk)
                 received_bytes += len(chunk)
                 if received_bytes >= INTERRUPTED_TRANSF_SIZE:
                     break
@@ -1114,11 +1129,9 @@ class TestFtpRetrieveData(unittest.TestCase):
             self.client.sendcmd('retr ' + self.temp_file_path)
         # test resume
         self.client.sendcmd(f'rest {received_bytes}')
-        self.client.retrbinary("retr " + self.temp_file_path, self.dummy_recvfile.write)
-        self.dummy_recvfile.seek(0)
-        datafile = self.dummy_recvfile.read()
-        assert len(data) == len(datafile)
-        assert hash(data) == hash(datafile)
+        self.client.retrbinary("retr " + self.temp_file_path, recvfile.write)
+        assert payload.size == recvfile.size
+        assert payload.digest() == recvfile.hexdigest()
 
     @pytest.mark.base
     def test_retr_empty_file(self):
@@ -1130,7 +1143,7 @@ class TestFtpRetrieveData(unittest.TestCase):
 
 class TestFtpnonFsOperations(unittest.TestCase):
     """Test: TYPE, STRU, MODE, NOOP, SYST, ALLO, HELP, SITE HELP."""
-    client_class = ftplib.FTP
+    client_class = FtpClient
     def setUp(self):
         super().setUp()
         server_host = self.uconfig.get('server_host')
@@ -1375,7 +1388,7 @@ class TestFtpnonFsOperations(unittest.TestCase):
 
 
 class TestFtpCmdsSemantic(unittest.TestCase):
-    client_class = ftplib.FTP
+    client_class = FtpClient
     arg_cmds = [
         'appe',
         'dele',
@@ -1483,6 +1496,7 @@ class TestFtpCmdsSemantic(unittest.TestCase):
         # Test those commands requiring client to be authenticated.
         expected = "530 Please login with USER and PASS.|530 Login with USER and PASS please."
         self.connect_and_not_login()
+        cmds = []
         for cmd in self.all_cmds:
             if cmd in (
                 'feat',
@@ -1499,9 +1513,9 @@ class TestFtpCmdsSemantic(unittest.TestCase):
                 continue
             if cmd in self.arg_cmds:
                 cmd += ' arg'
-            self.client.putcmd(cmd)
-            resp = self.client.getmultiline()
-            assert re.search(expected, resp) != None
+            cmds.append(cmd)
+        for cmd, resp in zip(cmds, self.client.sendcmds(cmds)):
+            assert re.search(expected, resp) != None, cmd
 
     @pytest.mark.base
     def test_noauth_cmds(self):
@@ -1510,7 +1524,7 @@ class TestFtpCmdsSemantic(unittest.TestCase):
             self.client.sendcmd(cmd)
 
 class TestNetWorkProtocols(unittest.TestCase):
-    client_class = ftplib.FTP
+    client_class = FtpClient
     def setUp(self):
         super().setUp()
         self.server_host = self.uconfig.get('server_host')
@@ -1740,7 +1754,7 @@ class TestNetWorkProtocols(unittest.TestCase):
             self.client.sendcmd('abor')
 
 class TestFtpAbort(unittest.TestCase):
-    client_class = ftplib.FTP
+    client_class = FtpClient
     def setUp(self):
         super().setUp()
         server_host = self.uconfig.get('server_host')
@@ -1794,6 +1808,8 @@ class TestFtpAbort(unittest.TestCase):
             return p
 
     def clean_tmp_file(self, subpath):
+        if self.defer_cleanup and is_test_artifact(subpath):
+            return
         try:
             self.client.delete(subpath)
         except Exception as e:
@@ -1805,12 +1821,9 @@ class TestFtpAbort(unittest.TestCase):
         # Case 4: ABOR while a data transfer on DTP channel is in
         # progress: close data channel, respond with 426, respond
         # with 226.
-        data = b'abcde12345' * 1000000
-        dummy_sendfile = io.BytesIO()
-        dummy_sendfile.write(data)
-        dummy_sendfile.seek(0)
+        payload = Payload(10000000)
         temp_file_path = self.get_tmp_file_path()
-        self.client.storbinary('stor ' + temp_file_path, dummy_sendfile)
+        self.client.storbinary('stor ' + temp_file_path, payload.reader())
         self.client.voidcmd('TYPE I')
         def do_abort_function():
             self.client.putcmd('ABOR')
@@ -1830,13 +1843,12 @@ class TestFtpAbort(unittest.TestCase):
             time.sleep(3)
 
         t1.join()
-        dummy_sendfile.close()
         self.clean_tmp_file(temp_file_path)
 
 class TestFtpListingCmds(unittest.TestCase):
     """Test LIST, NLST, argumented STAT."""
 
-    client_class = ftplib.FTP
+    client_class = FtpClient
 
     def setUp(self):
         super().setUp()
@@ -1851,15 +1863,33 @@ class TestFtpListingCmds(unittest.TestCase):
         self.client.login(server_user,server_password)
         self.work_dir = self.uconfig.get('work_dir')
         self.share_name = self.uconfig.get('share_name')
-        self.temp_dir_path = self.make_tmp_dir()
-        self.temp_file_path = self.make_tmp_file()
+        self._temp_dir_path = None
+        self._temp_file_path = None
 
     def tearDown(self):
-        self.clean_tmp_dir(self.temp_dir_path)
-        self.clean_tmp_file(self.temp_file_path)
+        if self._temp_dir_path != None:
+            self.clean_tmp_dir(self._temp_dir_path)
+        if self._temp_file_path != None:
+            self.clean_tmp_file(self._temp_file_path)
         self.client.close()
         super().tearDown()
 
+    @property
+    def temp_dir_path(self):
+        # created on first access, so tests that never use it skip
+        # the MKD/RMD round trips
+        if self._temp_dir_path == None:
+            self._temp_dir_path = self.make_tmp_dir()
+        return self._temp_dir_path
+
+    @property
+    def temp_file_path(self):
+        # created on first access, so tests that never use it skip
+        # the STOR/DELE round trips and the data connection
+        if self._temp_file_path == None:
+            self._temp_file_path = self.make_tmp_file()
+        return self._temp_file_path
+
     def make_tmp_dir(self):
         subpath = self.get_tmp_path()
         dirname = self.client.mkd(subpath)
@@ -1867,17 +1897,15 @@ class TestFtpListingCmds(unittest.TestCase):
         return subpath
 
     def clean_tmp_dir(self, subpath):
+        if self.defer_cleanup and is_test_artifact(subpath):
+            return
         try:
             self.client.rmd(subpath)
         except Exception as e:
             pass
 
     def upload_empty_file(self, tmp_path):
-        tmpfile = get_tmpfilename('-{}'.format(self._testMethodName))
-        touch_filename(tmpfile)
-        with open(tmpfile, 'rb') as f:
-            self.client.storbinary('stor ' + tmp_path, f)
-        os.remove(tmpfile)
+        self.client.upload_fixed_size(tmp_path)
 
     def make_tmp_file(self):
         tmp_path = self.get_tmp_path()
@@ -1885,6 +1913,8 @@ class TestFtpListingCmds(unittest.TestCase):
         return tmp_path
 
     def clean_tmp_file(self, subpath):
+        if self.defer_cleanup and is_test_artifact(subpath):
+            return
         try:
             self.client.delete(subpath)
         except Exception as e:
@@ -1908,9 +1938,14 @@ class TestFtpListingCmds(unittest.TestCase):
             tmp_file = get_tmpfilename('-{}'.format(self._testMethodName))
         return self.generate_valid_path(self.work_dir, self.share_name, tmp_file)
 
+    def prepare_tmp_fixtures(self):
+        # listing tests expect both entries to exist before listing
+        return self.temp_dir_path, self.temp_file_path
+
     @pytest.mark.base
     @pytest.mark.list
     def test_nlst_ok(self):
+        self.prepare_tmp_fixtures()
         subpaths = self.client.nlst(self.get_share_path())
         assert self.temp_dir_path in subpaths and self.temp_file_path in subpaths
 
@@ -1926,6 +1961,7 @@ class TestFtpListingCmds(unittest.TestCase):
     @pytest.mark.base
     @pytest.mark.list
     def test_nlst_no_path(self):
+        self.prepare_tmp_fixtures()
         self.client.cwd(self.get_share_path())
         subpaths = self.client.nlst()
         assert os.path.basename(self.temp_file_path) in subpaths and os.path.basename(self.temp_dir_path) in subpaths
@@ -1933,6 +1969,7 @@ class TestFtpListingCmds(unittest.TestCase):
     @pytest.mark.base
     @pytest.mark.list
     def test_nlst_glob_file(self):
+        self.prepare_tmp_fixtures()
         self.client.cwd(self.get_share_path())
         subpaths = self.client.nlst(f'{TEST_PREFIX}*')
         assert os.path.basename(self.temp_file_path) in subpaths and os.path.basename(self.temp_dir_path) in subpaths
@@ -1948,6 +1985,7 @@ class TestFtpListingCmds(unittest.TestCase):
     @pytest.mark.base
     @pytest.mark.list
     def test_nlst_glob_more_than_9999(self):
+        self.prepare_tmp_fixtures()
         clean_list = []
         for x in range(14998):
             temp_path = self.make_tmp_file()
@@ -2023,6 +2061,7 @@ class TestFtpListingCmds(unittest.TestCase):
     @pytest.mark.base
     @pytest.mark.list
     def test_nlst_parent(self):
+        self.prepare_tmp_fixtures()
         self.client.cwd(self.temp_dir_path)
         subpaths = self.client.nlst('..////')
         assert any(os.path.basename(self.temp_dir_path) in s for s in subpaths) and \
@@ -2070,6 +2109,7 @@ class TestFtpListingCmds(unittest.TestCase):
     @pytest.mark.base
     @pytest.mark.list
     def test_list_ok(self):
+        self.prepare_tmp_fixtures()
         subpaths = []
         self.client.retrlines('list ' + self.get_share_path(), subpaths.append)
         subpaths = [x.split(" ")[-1] for x in subpaths]
@@ -2095,9 +2135,23 @@ class TestFtpListingCmds(unittest.TestCase):
         assert subsubname in subpaths
         self.clean_tmp_dir(subsubpath)
 
+    @pytest.mark.base
+    @pytest.mark.list
+    def test_list_deeppath(self):
+        tree = TreeBuilder(self.client, self.get_share_path())
+        try:
+            levels = tree.deep(32, name_len=32, files_per_level=1)
+            subpaths = []
+            self.client.retrlines('list ' + levels[-1], subpaths.append)
+            subpaths = [x.split(" ")[-1] for x in subpaths]
+            assert 'f0000' in subpaths
+        finally:
+            tree.remove()
+
     @pytest.mark.base
     @pytest.mark.list
     def test_list_with_arguments(self):
+        self.prepare_tmp_fixtures()
         l1 = l2 = l3 = l4 = l5 = []
         self.client.retrlines('list ' + self.get_share_path(), l1.append)
         self.client.retrlines('list -a ' + self.get_share_path(), l2.append)
@@ -2111,6 +2165,7 @@ class TestFtpListingCmds(unittest.TestCase):
     @pytest.mark.base
     @pytest.mark.list
     def test_list_rel_path(self):
+        self.prepare_tmp_fixtures()
         self.client.cwd(self.get_share_path())
         l1 = []
         self.client.retrlines('list', l1.append)
@@ -2120,6 +2175,7 @@ class TestFtpListingCmds(unittest.TestCase):
     @pytest.mark.base
     @pytest.mark.list
     def test_list_glob_file(self):
+        self.prepare_tmp_fixtures()
         self.client.cwd(self.get_share_path())
         subpaths = []
         self.client.retrlines(f'list {TEST_PREFIX}*', subpaths.append)
@@ -2149,6 +2205,7 @@ class TestFtpListingCmds(unittest.TestCase):
     @pytest.mark.base
     @pytest.mark.list
     def test_list_wildcard(self):
+        self.prepare_tmp_fixtures()
         self.client.cwd(self.get_share_path())
         subpaths = []
         self.client.retrlines('list *', subpaths.append)
@@ -2170,6 +2227,7 @@ class TestFtpListingCmds(unittest.TestCase):
     @pytest.mark.base
     @pytest.mark.stat
     def test_stat_dir_ok(self):
+        self.prepare_tmp_fixtures()
         resp = self.client.sendcmd('stat ' + self.get_share_path())
         subpaths = [x.split(" ")[-1] for x in resp.split("\n")[1:-1]]
         assert os.path.basename(self.temp_dir_path) in subpaths and os.path.basename(self.temp_file_path) in subpaths
@@ -0,0 +1,202 @@
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+import pytest
+
+from . import bench
+from . import scenario
+from . import procstats
+from . import agent
+from .driver import encode_phases
+
+pytestmark = pytest.mark.unit
+
+class TestScenarioShard(unittest.TestCase):
+    """Sharded scenarios add up to the unsharded one."""
+    data = {
+        'mode': 'open',
+        'arrivals': 'poisson',
+        'seed': 3,
+        'sessions': 8,
+        'operations': [{'op': 'list'}],
+        'phases': [{'name': 'up', 'duration': 2, 'rate': [10, 200]},
+                   {'name': 'steady', 'duration': 2, 'rate': 200}],
+    }
+
+    def test_shard_schedules_split_unsharded(self):
+        for arrivals in ('poisson', 'uniform'):
+            whole = scenario.Scenario(dict(self.data, arrivals=arrivals))
+            plan = whole.schedule()
+            for count in (1, 2, 3, 7):
+                parts = [whole.shard(i, count).schedule() for i in range(count)]
+                for i, part in enumerate(parts):
+                    assert part == [plan[k] for k in range(i, len(plan), count)], (arrivals, count, i)
+                # the shards take turns: the j-th arrivals of all shards
+                # come one after another, before any shard's next one
+                for j in range(len(parts[-1])):
+                    times = [part[j][0] for part in parts]
+                    assert times == sorted(times), (arrivals, count, j)
+                    if count > 1:
+                        assert times[0] < times[-1], (arrivals, count, j)
+                    if j + 1 < len(parts[0]):
+                        assert times[-1] <= parts[0][j + 1][0]
+
+    def test_shard_sessions_cover_unsharded(self):
+        whole = scenario.Scenario(dict(self.data, mode='closed'))
+        parts = [whole.shard(i, 3) for i in range(3)]
+        numbers = sorted(part.session_number(i) for part in parts for i in range(part.max_sessions))
+        assert numbers == list(range(whole.max_sessions))
+        for elapsed in (0.5, 2.5):
+            assert sum(part.target(elapsed)[1] for part in parts) == whole.target(elapsed)[1]
+
+def stat_line(pid, comm, ppid, utime=0, stime=0, cutime=0, cstime=0, threads=1, rss=0):
+    # the fields of /proc/<pid>/stat, from field 3 (state) on
+    fields = ['S', ppid, pid, pid, 0, -1, 4194560, 100, 0, 0, 0, utime, stime, cutime, cstime,
+              20, 0, threads, 0, 12345, 1 << 24, rss] + [0] * 30
+    return f'{pid} ({comm}) ' + ' '.join(str(f) for f in fields) + '\n'
+
+class TestProcStats(unittest.TestCase):
+    """/proc parsing of the server sampler, on fake /proc text."""
+
+    def setUp(self):
+        super().setUp()
+        self.proc = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(procstats, 'PROC', self.proc.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.proc.cleanup)
+
+    def add(self, pid, ppid, comm='ftpd', **kwargs):
+        path = os.path.join(self.proc.name, str(pid))
+        os.makedirs(os.path.join(path, 'fd'))
+        with open(os.path.join(path, 'stat'), 'w') as f:
+            f.write(stat_line(pid, comm, ppid, **kwargs))
+        with open(os.path.join(path, 'status'), 'w') as f:
+            f.write(f'Name:\t{comm}\nPid:\t{pid}\nPPid:\t{ppid}\n'
+                    'voluntary_ctxt_switches:\t7\nnonvoluntary_ctxt_switches:\t3\n')
+
+    def test_read_stat_fields(self):
+        self.add(42, 7, comm='vsftpd (priv) x', utime=11, stime=5, cutime=3, cstime=2, threads=4, rss=100)
+        stat = procstats.read_stat(42)
+        assert stat == {'ppid': 7, 'ticks': 21, 'threads': 4, 'rss': 100 * procstats.PAGE_SIZE}
+
+    def test_descendants(self):
+        for pid, ppid in ((1, 0), (10, 1), (11, 10), (12, 10), (13, 11), (20, 1), (21, 20)):
+            self.add(pid, ppid)
+        assert procstats.descendants(10) == [10, 11, 12, 13]
+        assert procstats.descendants(13) == [13]
+
+    def test_counter_deltas(self):
+        last = {10: (100, 5, 1, 0, 0), 11: (30, 2, 0, 0, 0)}
+        # 11 was reaped into 10's child time, 12 is new with time of its own
+        counters = {10: (100 + 35, 6, 1, 10, 20), 12: (500, 50, 5, 7, 7)}
+        assert procstats.counter_deltas(last, counters) == [5, 1, 0, 10, 20]
+
+    def test_read_status_and_io(self):
+        self.add(42, 1)
+        assert procstats.read_status(42) == (7, 3)
+        # /proc/<pid>/io of another user's process can't be read
+        assert procstats.read_io(42) == (0, 0)
+        with open(os.path.join(self.proc.name, '42', 'io'), 'w') as f:
+            f.write('rchar: 4096\nwchar: 512\nsyscr: 3\nsyscw: 1\n')
+        assert procstats.read_io(42) == (4096, 512)
+
+    def test_correlation(self):
+        xs = [1, 2, 3, 4]
+        assert procstats.correlation(xs, [2, 4, 6, 8]) == pytest.approx(1.0)
+        assert procstats.correlation(xs, [8, 6, 4, 2]) == pytest.approx(-1.0)
+        assert procstats.correlation(xs, [5, 5, 5, 5]) == 0.0
+        assert procstats.correlation([1, 2], [1, 2]) == 0.0
+
+    def test_no_correlation_without_latencies(self):
+        self.add(10, 1, utime=1)
+        sampler = procstats.ServerSampler(10)
+        sampler.start()
+        sampler.stop()
+        result = sampler.results()
+        assert result['samples'] >= 1 and result['p99_correlation'] == None
+
+class TestCoordinator(unittest.TestCase):
+    """Coordinator with fake agents speaking the protocol over loopback."""
+    data = {'sessions': 1, 'duration': 1, 'operations': [{'op': 'list'}]}
+
+    def setUp(self):
+        super().setUp()
+        self.coordinator = agent.Coordinator({}, scenario.Scenario(self.data), '/root', 2)
+        self.addCleanup(self.coordinator.close)
+
+    def connect(self, hello={'type': 'hello', 'pid': 1}):
+        conn = agent.Connection(socket.create_connection(self.coordinator.address, 5))
+        self.addCleanup(conn.close)
+        if hello != None:
+            conn.send(hello)
+        return conn
+
+    def stats(self, ops):
+        stats = bench.OpStats()
+        for _ in range(ops):
+            stats.record('list', 0.001)
+        return encode_phases({'steady': stats})
+
+    def run_agent(self, conn, die=False):
+        msg = conn.receive()
+        conn.send({'type': 'prepared'})
+        conn.receive()
+        conn.send({'type': 'progress', 'elapsed': 0.5, 'stats': self.stats(3)})
+        if die:
+            conn.close()
+            return
+        conn.send({'type': 'result', 'worker': msg['worker'], 'pid': 1, 'cpu': None, 'error': None,
+                   'created': [], 'dirs': [], 'stats': self.stats(5)})
+
+    def test_accept_skips_bad_hellos(self):
+        stray = socket.create_connection(self.coordinator.address, 5)
+        stray.sendall(b'GET / HTTP/1.0\r\n\r\n')
+        self.connect({'type': 'result'})
+        self.connect()
+        self.connect()
+        self.coordinator.accept(5)
+        stray.close()
+        assert len(self.coordinator.conns) == 2
+
+    def test_dead_agent_keeps_streamed_results(self):
+        conns = [self.connect(), self.connect()]
+        self.coordinator.accept(5)
+        threads = [threading.Thread(target=self.run_agent, args=(conn, i == 0)) for i, conn in enumerate(conns)]
+        for thread in threads:
+            thread.start()
+        results = self.coordinator.run(timeout=10)
+        for thread in threads:
+            thread.join()
+        assert 'went away' in results[0].error and results[0].ops() == 3
+        assert self.coordinator.updates[0] == 1 and 'steady' in self.coordinator.live[0]
+        assert results[1].error == None and results[1].ops() == 5
+
+    def prepare_and_leave(self, conn):
+        conn.receive()
+        conn.send({'type': 'prepared'})
+        conn.close()
+
+    def test_agent_gone_before_start(self):
+        conns = [self.connect(), self.connect()]
+        self.coordinator.accept(5)
+        first = self.coordinator.conns[0]
+        send = first.send
+
+        def broken_start(msg):
+            if msg['type'] == 'start':
+                raise BrokenPipeError(32, 'Broken pipe')
+            send(msg)
+        first.send = broken_start
+        threads = [threading.Thread(target=self.prepare_and_leave, args=(conns[0],)),
+                   threading.Thread(target=self.run_agent, args=(conns[1],))]
+        for thread in threads:
+            thread.start()
+        results = self.coordinator.run(timeout=10)
+        for thread in threads:
+            thread.join()
+        assert 'went away' in results[0].error and results[0].ops() == 0
+        assert results[1].error == None and results[1].ops() == 5
@@ -0,0 +1,87 @@
+import posixpath
+
+from . import get_tmpfilename
+from .client import check_reply
+
+def component_name(level, name_len):
+    name = f'd{level:03d}'
+    return name + 'x' * max(name_len - len(name), 0)
+
+class TreeBuilder:
+    """Build deep or wide directory trees on the server.
+
+    Directories are created with pipelined MKD batches, which is safe
+    because the server handles them in order, so a parent always exists
+    before its children. Empty files are uploaded over `pool` when one is
+    given. The top directory carries the test prefix, so a tree leaked by
+    a crashed test is picked up by the session end collector.
+    """
+
+    def __init__(self, client, base, pool=None):
+        self.client = client
+        self.base = base
+        self.pool = pool
+        self.dirs = []
+        self.files = []
+
+    def make_root(self, suffix=''):
+        root = posixpath.join(self.base, get_tmpfilename(suffix))
+        self.make_dirs([root])
+        return root
+
+    def make_dirs(self, paths):
+        # record what was created before raising, so remove() gets it
+        resps = self.client.sendcmds(['mkd ' + p for p in paths])
+        self.dirs.extend(p for p, resp in zip(paths, resps) if resp[:1] == '2')
+        for resp in resps:
+            check_reply(resp)
+
+    def make_files(self, paths, size=0):
+        # a failed upload may still leave a partial file; remove() ignores
+        # the 550 for those that don't exist
+        self.files.extend(paths)
+        if self.pool != None:
+            for path, _, err in self.pool.map(lambda c, p: c.upload_fixed_size(p, size), paths):
+                if err != None:
+                    raise err
+        else:
+            for path in paths:
+                self.client.upload_fixed_size(path, size)
+
+    def deep(self, depth, name_len=8, files_per_level=0, suffix='-deep'):
+        """Create a chain of `depth` directories, return them top down."""
+        levels = []
+        path = self.make_root(suffix)
+        for level in range(1, depth + 1):
+            path = posixpath.join(path, component_name(level, name_len))
+            levels.append(path)
+        self.make_dirs(levels)
+        if files_per_level:
+            self.make_files([posixpath.join(p, f'f{i:04d}')
+                             for p in levels for i in range(files_per_level)])
+        return levels
+
+    def wide(self, width, depth=1, name_len=8, files_per_dir=0, suffix='-wide'):
+        """Create `width` subdirectories per directory, `depth` levels deep."""
+        root = self.make_root(suffix)
+        level = [root]
+        created = []
+        for _ in range(depth):
+            level = [posixpath.join(parent, component_name(i, name_len))
+                     for parent in level for i in range(width)]
+            self.make_dirs(level)
+            created.extend(level)
+        if files_per_dir:
+            self.make_files([posixpath.join(p, f'f{i:04d}')
+                             for p in [root] + created for i in range(files_per_dir)])
+        return created
+
+    def remove(self):
+        """Remove everything this builder created, deepest first."""
+        if self.files:
+            self.client.sendcmds(['dele ' + p for p in self.files])
+        dirs = sorted(self.dirs, key=lambda p: p.count('/'), reverse=True)
+        if dirs:
+            self.client.sendcmds(['rmd ' + p for p in dirs])
+        self.files = []
+        self.dirs = []
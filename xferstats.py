@@ -0,0 +1,171 @@
+import contextlib
+import math
+import time
+from array import array
+
+from . import bench
+from .histogram import LatencyHistogram
+
+# set by conftest while a test runs with --trace_transfers
+recorder = None
+
+PHASES = [
+    # (phase, from mark, to mark)
+    ('pasv', 'start', 'pasv'),
+    ('to_150', 'pasv', 'reply_150'),
+    ('first_byte', 'reply_150', 'first_byte'),
+    ('stream', 'first_byte', 'last_byte'),
+    ('close', 'last_byte', 'closed'),
+    ('close_to_226', 'closed', 'reply_226'),
+    ('total', 'start', 'reply_226'),
+]
+
+@contextlib.contextmanager
+def recording(new_recorder):
+    global recorder
+    saved, recorder = recorder, new_recorder
+    try:
+        yield new_recorder
+    finally:
+        recorder = saved
+
+def phase_summary(traces):
+    """Latency percentiles per transfer phase over many traces."""
+    hists = {}
+    for trace in traces:
+        for phase, seconds in trace.phases().items():
+            hists.setdefault(phase, LatencyHistogram()).record(seconds)
+    return {phase: hists[phase].summary() for phase, _, _ in PHASES if phase in hists}
+
+class TransferTrace:
+    """Timestamps and sizes of every chunk moved on one data connection,
+    plus the control channel milestones of the transfer.
+    """
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.start = time.perf_counter()
+        self.end = None
+        self.marks = {}
+        self.times = array('d')
+        self.sizes = array('q')
+
+    def mark(self, name):
+        self.marks[name] = time.perf_counter()
+
+    def phases(self):
+        marks = dict(self.marks, start=self.start)
+        if self.times:
+            marks['first_byte'] = self.times[0]
+            marks['last_byte'] = self.times[-1]
+        if self.end != None:
+            marks['closed'] = self.end
+        # without a PASV/PORT of our own the command follows right away
+        marks.setdefault('pasv', self.start)
+        return {phase: marks[b] - marks[a] for phase, a, b in PHASES
+                if a in marks and b in marks}
+
+    def record(self, nbytes):
+        if nbytes:
+            self.times.append(time.perf_counter())
+            self.sizes.append(nbytes)
+
+    def close(self):
+        if self.end == None:
+            self.end = time.perf_counter()
+
+    def series(self, interval):
+        """Throughput in bytes/sec per `interval` seconds, from first to last chunk."""
+        if not self.times:
+            return []
+        first = self.times[0]
+        duration = self.times[-1] - first
+        nbins = max(int(math.ceil(duration / interval)), 1)
+        bins = [0] * nbins
+        for t, n in zip(self.times, self.sizes):
+            bins[min(int((t - first) / interval), nbins - 1)] += n
+        widths = [interval] * (nbins - 1) + [max(duration - (nbins - 1) * interval, interval / 1000)]
+        return [(i * interval, b / w) for i, (b, w) in enumerate(zip(bins, widths))]
+
+    def metrics(self, interval=0.1, below_pct=50):
+        gaps = [b - a for a, b in zip(self.times, self.times[1:])]
+        series = self.series(interval)
+        rates = [rate for _, rate in series]
+        median_rate = bench.percentile(rates, 50)
+        threshold = median_rate * below_pct / 100.0
+        time_below = sum((interval for rate in rates if rate < threshold), 0.0)
+        nbytes = sum(self.sizes)
+        seconds = (self.end or time.perf_counter()) - self.start
+        return {
+            'cmd': self.cmd,
+            'bytes': nbytes,
+            'seconds': seconds,
+            'mb_per_sec': nbytes / seconds / 1e6 if seconds else 0.0,
+            'chunks': len(self.sizes),
+            'longest_gap': max(gaps) if gaps else 0.0,
+            'p99_gap': bench.percentile(gaps, 99),
+            'median_rate': median_rate,
+            f'time_below_{below_pct:g}pct': time_below,
+            'phases': self.phases(),
+            'series': series,
+        }
+
+class TransferRecorder:
+    def __init__(self, interval=0.1, below_pct=50):
+        self.interval = interval
+        self.below_pct = below_pct
+        self.traces = []
+
+    def new_trace(self, cmd):
+        trace = TransferTrace(cmd)
+        self.traces.append(trace)
+        return trace
+
+    def results(self):
+        return [trace.metrics(self.interval, self.below_pct) for trace in self.traces]
+
+    def phase_summary(self):
+        return phase_summary(self.traces)
+
+class TracedConnection:
+    """Data socket proxy timestamping every chunk sent or received.
+
+    Only the socket methods are traced; readers going through makefile(),
+    like retrlines(), are not.
+    """
+
+    def __init__(self, sock, trace):
+        self.sock = sock
+        self.trace = trace
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def recv(self, bufsize, *flags):
+        data = self.sock.recv(bufsize, *flags)
+        self.trace.record(len(data))
+        return data
+
+    def recv_into(self, buffer, *args):
+        n = self.sock.recv_into(buffer, *args)
+        self.trace.record(n)
+        return n
+
+    def send(self, data, *flags):
+        n = self.sock.send(data, *flags)
+        self.trace.record(n)
+        return n
+
+    def sendall(self, data, *flags):
+        self.sock.sendall(data, *flags)
+        self.trace.record(len(data))
+
+    def close(self):
+        self.trace.close()
+        self.sock.close()